@@ -115,6 +115,7 @@ import tensorflow as tf
 
 import os
 import sys
+import subprocess
 
 # standard mathamatical operations
 import numpy as np
@@ -126,15 +127,41 @@ import numpy as np
 from crbm import train_crbm
 
 # import the laser simulation - this will be used while determining the control
-# inputs in order to compare the predicted and the true states/costfunction
-from mlock_CNLS import laser_simulation
+# inputs in order to compare the predicted and the true states/costfunction.
+# The results are memoized since the same angles and birefringence values are
+# simulated several times during the control
+from simulation_cache import SimulationCache
+simulation_cache = SimulationCache('simulation_cache.sqlite')
+laser_simulation = simulation_cache.laser_simulation
+from warm_start import WarmStartSimulation
+# persistent laser cavity as the plant of the control
+from virtual_laser import VirtualLaser
+from mlock_CNLS import Rnd
+# gaussian process answering simulations in well sampled regions
+from surrogate import SurrogateSimulation
+
+# parallel, resumable generation of new data sets
+from dataset_generation import run_directory, load_dataset
+# append-only binary store of all simulation results
+from record_store import RecordStore, simulation_records, configuration_fields
+
+# lookup of the best angles for a given birefringence
+from angle_lookup import KIndex, k_u_training_set
+
+# vectorized construction of the training and test batches
+from batch_windows import window_batch, chunked_split, segment_starts
+
+# one-pass statistics and (lazy) normalization of the data sets
+from normalization import StreamingNormalizer
+
+# the workbooks are parsed once and memory mapped from a binary cache
+from dataset_cache import load_array, iter_chunks
 
 # function to import the data to train the model
 #from load_preprocess import load_data
 
 # csv package to write results into a CSV file
 import csv
-import xlrd
 
 import argparse
 import operator
@@ -160,6 +187,8 @@ num_latent_var = 1
 num_wave_plates = 4
 # 3 states + 4 wave plates - num_latent_var
 num_parameters = num_states + num_wave_plates - num_latent_var
+# columns of the wave plate angles in the data set
+u_columns = slice(num_states - num_latent_var, num_parameters)
 # total number of inputs
 num_inputs_RNN = (delay + 1)*(2*num_parameters + num_wave_plates)
 # variable for the creation of the RNN Cell to distiguish between the pre 
@@ -195,6 +224,36 @@ layers = 2
 reuse_model = True
 new_dataset = False
 
+# seed the laser simulations with the final field of the nearest configuration
+# simulated before instead of the sech pulse - consecutive control steps have
+# nearly identical angles and birefringence values. A warm started simulation
+# can end in a different steady state than a cold started one. The seeded
+# simulations run behind the cache, which stays addressed by the field of the
+# caller, so identical calls are still answered by the cache
+warm_start = False
+if warm_start:
+    simulation_cache.simulate = WarmStartSimulation(simulation_cache.simulate)
+
+# control_pred: the laser keeps its field between the control steps and is
+# advanced by a few round trips per step (VirtualLaser) instead of being 
+# simulated from the sech pulse for every step
+virtual_laser = False
+
+# answer the simulations of the control by a surrogate (gaussian process on
+# the results simulated so far) where its relative uncertainty of E and M4 
+# is below surrogate_threshold, otherwise simulate and add the result
+surrogate = False
+surrogate_threshold = 0.02
+if surrogate:
+    laser_simulation = SurrogateSimulation(laser_simulation, 
+                                           threshold=surrogate_threshold)
+
+# None: the first 70% of the new data set are the training set, the rest the
+# test set. Otherwise the statistics of the data set are collected chunk by
+# chunk of data_chunksize rows and the chunks are assigned alternately to the
+# training and the test set (70%/30%, see chunked_split)
+data_chunksize = None
+
 
 """ Pre-set some FLAGS to easily change parameters """
 
@@ -260,6 +319,9 @@ if not reuse_model:
 def get_data(filename):
     """ Load data from a xlsx file
     
+    The workbook is converted only once, later runs memory map the binary 
+    copy in the cache (see dataset_cache.load_array).
+    
     Parameters
     --------------------------------------------------------------------------
     file name:  string
@@ -273,17 +335,7 @@ def get_data(filename):
                 workbook
     """
     
-    simulation_results = xlrd.open_workbook(filename)
-    worksheet = simulation_results.sheet_by_index(0)
-    
-    batchdata = np.asarray(worksheet.col_values(0)).reshape((-1,1))
-    
-    num_col = worksheet.row_len(0)
-    for i in range(1,num_col):
-        batchdata = np.concatenate((batchdata, 
-                np.asarray(worksheet.col_values(i)).reshape((-1,1))), axis=1)
-    
-    return batchdata
+    return load_array(filename)
 
 
 # load the input data
@@ -782,14 +834,15 @@ d_dataset = data
 # calculate the objective function for the data set
 objective = d_dataset[:,0]/d_dataset[:,1]
 
-# calculate mean, stddev, minimum and maximum for the data set
-data_mean = data.mean(axis=0)
-data_std = data.std(axis=0)
-data_min = data.min(axis=0)
-data_max = data.max(axis=0)
+# calculate mean, stddev, minimum and maximum for the data set in one pass
+data_stats = StreamingNormalizer().update(data)
+data_mean = data_stats.mean
+data_std = data_stats.std
+data_min = data_stats.min
+data_max = data_stats.max
 
 # for learning the normalized data will be used
-data = (data-data_mean)/data_std
+data = data_stats.zscore(data)
 
 
 #%%
@@ -820,6 +873,9 @@ def get_angles(k):
 
     Results
     --------------------------------------------------------------------------
+    The search uses k_index (angle_lookup.KIndex), which answers many 
+    queries at once.
+    
     This function is used to generate a new data set. It is critical to
     determine a good data set for the birefringence-control mapping since very 
     small changes in the orientation of the angles will result in drastic 
@@ -828,50 +884,11 @@ def get_angles(k):
     the highest objective function values in a certain interval.
 
     """
-    index = 0
-    max_index, max_value = max(enumerate(objective),
-                           key=operator.itemgetter(1))
-    ks = k
-    for t_step in range(1):
-        obj = 0
-        # find the best initial configuration for a given k in the
-        # interval [0.98k, 1.02k]
-        dx = (K_ub - K_lb)/50  #0.02
-        for ind, item in enumerate(data[:,2]):
-            #if (ind > 2*delay + 3):
-                if (ks > K_lb + dx and ks < K_ub - dx):
-                    if (item > ks-dx and item < ks+dx):
-                        denorm_trainset = d_dataset[ind,:]
-                        if obj < denorm_trainset[0]/denorm_trainset[1]:
-                            obj = denorm_trainset[0]/denorm_trainset[1]
-                            index = ind
-                elif ks < K_lb + dx:
-                    if (item >= K_lb and item < ks+dx):
-                        denorm_trainset = d_dataset[ind,:]
-                        if obj < denorm_trainset[0]/denorm_trainset[1]:
-                            obj = denorm_trainset[0]/denorm_trainset[1]
-                            index = ind
-                elif ks > K_ub - dx:
-                    if (item > ks-dx and item <= K_ub):
-                        denorm_trainset = d_dataset[ind,:]
-                        if obj < denorm_trainset[0]/denorm_trainset[1]:
-                            obj = denorm_trainset[0]/denorm_trainset[1]
-                            index = ind
-
-        if obj == 0:
-            obj = max_value
-
-        if index > 0 and t_step == 0:
-            max_index = index
-            ks = data[max_index, 2]
-
-        print(index, obj, ks)
-        val = np.reshape(d_dataset[index,num_states:],[1,num_wave_plates])
-
-    output = []
-    for i in range(num_wave_plates):
-        output.append(val[0,i])
-    return ks,output,obj
+    index, obj, ks = k_index.query(k)
+    print(index[0], obj[0], ks[0])
+    
+    output = list(d_dataset[index[0],num_states:num_states+num_wave_plates])
+    return ks[0],output,obj[0]
 
 
 #%%
@@ -882,6 +899,9 @@ K_ub = max(d_dataset[:,2])
 # define data set for K-u mapping
 K_pre_steps = np.linspace(K_lb, K_ub, 1000)
 
+# index of the data set sorted by the birefringence for get_angles
+k_index = KIndex(data[:,2], objective, K_lb, K_ub)
+
 # batch sizes for pretrainig and the actual control task
 if (len(data)-2*delay-3-2*steps_phase_2 < 200):
     test_batch_1 = seqlen_test-2*(delay+steps_phase_1)-3
@@ -893,66 +913,19 @@ else:
 control_batch_size = 1
 
 if reuse_model: #not
-    K_u_list = []
-    for i in range(len(K_pre_steps)):
-        ks, output, obj = get_angles(K_pre_steps[i])
-        val = np.concatenate(([ks], output, [abs(ks-K_pre_steps[i])], [obj]), 
-                              axis=0)
-        K_u_list.append(val)
-    
-    # sort the list, first by the birefringence value, than by the objective 
-    # function value and thereafter by the difference between the input 
-    # birefringence and the best birefrengence
-    K_u_list = sorted(K_u_list, key=lambda x: (x[0], -x[-1], -x[-2]))
-    K_u_list = np.vstack(K_u_list)
-    i = 1
-    length = len(K_u_list)
-    # delete duplicates since only the best data points of the data set where 
-    # choosen
-    while i < length:
-        if(K_u_list[i,0] == K_u_list[i-1,0]):
-            K_u_list = np.delete(K_u_list,i-1,0)
-            length -= 1
-        else:
-            i += 1
-            
-    K_u_list = np.delete(K_u_list,5,1)
-    
-    # calculate mean, stddev, and the gradients of the K_u_list
-    K_u_mean = K_u_list.mean(axis=0)
-    K_u_std = K_u_list.std(axis=0)
-    K_u_mean[0] = 0
-    K_u_std[0] = 1
-    K_u = (K_u_list-K_u_mean)/K_u_std
-    K_u_grad = np.gradient(K_u, axis=0)
-    
-    # if the gradient is small enough further data points will be included. 
-    # This is advantageous to avoid overfitting.
-    K_u_new = []
-    for i in range(len(K_u)-1):
-        K_u_new.append(K_u_list[i,:])
-        max_val = np.max(abs(K_u_grad[i,:]))
-        if max_val < 1:
-            diff = K_u_list[i+1,:] - K_u_list[i,:]
-            for m in range(1,1001):
-                val = K_u_list[i,:] + m*diff/1000.0
-                K_u_new.append(val)
-    
-    K_u_list = np.vstack(K_u_new)
-    
-    K_u_list = (K_u_list - K_u_mean)/K_u_std
+    # best data points around all K_pre_steps at once (see get_angles)
+    index, obj, ks = k_index.query(K_pre_steps)
+    
+    # sort the data points, first by the birefringence value, than by the 
+    # objective function value and thereafter by the difference between the
+    # input birefringence and the best birefrengence. Duplicates are deleted 
+    # and if the gradient is small enough further data points will be 
+    # interpolated. This is advantageous to avoid overfitting.
+    K_u_list, K_u_mean, K_u_std, K_u_train, K_u_test = k_u_training_set(ks,
+                    d_dataset[index,num_states:num_states+num_wave_plates],
+                    np.abs(ks-K_pre_steps), obj)
     "specify data_mean and data_std that it won't get lost"
     #K_u_list[:,1:5] = (K_u_list[:,1:5]-data_mean[3:])/data_std[3:]
-    
-    # split K_u_list into training and test set     
-    K_u_train = np.zeros([(len(K_u_list)//3)*2 + 1, num_wave_plates + 1])
-    K_u_test = np.zeros([len(K_u_list)//3, num_wave_plates + 1])
-    
-    for step in range(len(K_u_list)//3):
-        K_u_train[step*2:(step+1)*2] = K_u_list[step*3:2+step*3,:-1]
-        K_u_test[step] = K_u_list[2+step*3,:-1]
-        
-    K_u_train[-1] = K_u_list[-1,:-1]
         
     train_ind = np.linspace(0,len(K_u_train)-101,len(K_u_train)-100)
     
@@ -1326,25 +1299,31 @@ with tf.Session() as sess:
         map_out = sess.run([layer[-1]],feed_dict={K: k_VAE})
                 
         map_out = map_out[0]
-            
-        s = []
-        T = 60
-        n = 256
-        t2 = np.linspace(-T/2,T/2,n+1)
-        t_dis = t2[0:n].reshape([1,n])      # time discretization
-        u=np.reshape(sech(t_dis/2), [n,])   # orthogonally polarized electric field 
-        v=np.reshape(sech(t_dis/2), [n,])   # envelopes in the optical fiber
-        ut=np.fft.fft(u).reshape(n,)        # fast fourier transformation of the
-        vt=np.fft.fft(v).reshape(n,)        # electrical fields
-        uvt=np.concatenate([ut, vt], axis=0)# concatenation of ut and vt
-        for i in range(len(map_out)):
-            if i % 100 == 0:
-                print(i)
-            (_,states) = laser_simulation(uvt, map_out[i,0], map_out[i,1], 
-            map_out[i,2], map_out[i,3], data_k[i,2])
-            s.append(states)
-                    
-        s = np.vstack(s)
+        
+        # the simulations run in parallel, finished chunks are stored in 
+        # 'simulation_results_new_angles/run_<hash of the configurations>/' 
+        # and an interrupted run resumes from there. The process pool is 
+        # started by a new interpreter, forking this process with the threads
+        # of the tensorflow session can deadlock
+        configurations = np.concatenate((map_out[:,:num_wave_plates],
+                                         data_k[:len(map_out),2:3]), axis=1)
+        out_dir = run_directory('simulation_results_new_angles', 
+                                configurations)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        np.save(out_dir + '.npy', configurations)
+        subprocess.check_call([sys.executable, os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 
+                'dataset_generation.py'), out_dir + '.npy', out_dir])
+        (_, s, locked) = load_dataset(out_dir)
+        s = np.column_stack(s)
+        
+        # the results are also collected in the record store, which can be 
+        # memory mapped for the training. Configurations stored by an 
+        # earlier run are not appended again
+        RecordStore('simulation_results.store').append(simulation_records(
+            configurations, s, locked=locked, source='new_angles'), 
+            unique=configuration_fields)
         
         with open('simulation_results_new_angles.csv', 'w',newline='') as csvfile:
             spamwriter = csv.writer(csvfile)
@@ -1362,13 +1341,21 @@ with tf.Session() as sess:
     # load the input data
     # simulation_results__new_angles_k.xlsx
     data_no_K = get_data('simulation_results_new_angles.xlsx')
+    # mean, stddev, maximum and minimum of the new data set not containing 
+    # the birefringence K (one pass)
+    if data_chunksize is None:
+        data_no_K_stats = StreamingNormalizer().update(data_no_K)
+    else:
+        data_no_K_stats = StreamingNormalizer.from_chunks(iter_chunks(
+                'simulation_results_new_angles.xlsx', data_chunksize))
     # the means and stds will be updated once K is inferenced
-    data_mean_ctrl = data_no_K.mean(axis=0)
-    data_std_ctrl = data_no_K.std(axis=0)
+    data_mean_ctrl = data_no_K_stats.mean
+    data_std_ctrl = data_no_K_stats.std
     data_k = get_data('simulation_results_new_angles_k.xlsx')
     seqlen = len(data_no_K)
     # divide input data into trainings and test set (70%/30%)  
-    seqlen_train = int(0.7*seqlen)
+    train_segments, test_segments = chunked_split(seqlen, data_chunksize)
+    seqlen_train = sum(stop - start for start, stop in train_segments)
     seqlen_test = seqlen - seqlen_train
     parameters = np.shape(data_k)[1]
     
@@ -1381,39 +1368,45 @@ with tf.Session() as sess:
     # calculate the objective function values of the new data set
     objective = d_dataset[:,0]/d_dataset[:,1]
     
-    # calculate the mean, stddev, maximum and minimum of the new data set not
-    # containing the birefringence K
-    data_no_K_mean = data_no_K.mean(axis=0)
-    data_no_K_std = data_no_K.std(axis=0)
-    data_no_K_max = data_no_K.max(axis=0)
-    data_no_K_min = data_no_K.min(axis=0)
+    data_no_K_mean = data_no_K_stats.mean
+    data_no_K_std = data_no_K_stats.std
+    data_no_K_max = data_no_K_stats.max
+    data_no_K_min = data_no_K_stats.min
     
-    # normalization of the data set not containing the birefringence K
-    data_no_K = (data_no_K-data_no_K_mean)/data_no_K_std
+    # normalization of the data set not containing the birefringence K (in
+    # place, data was copied from it already)
+    data_no_K = data_no_K_stats.zscore(data_no_K, out=data_no_K)
     
-    # spliting data set into training and test set
-    train_data = data_no_K[0:seqlen_train,:]
-    test_data = data_no_K[seqlen_train:seqlen,:]
+    # the batches take their windows from the segments of the training and
+    # the test set (train_segments, test_segments) of the whole data set
+    train_data = data_no_K
+    test_data = data_no_K
     
     # calculate the mean, stddev, maximum and minimum of the new data set
-    data_mean = data.mean(axis=0)
+    data_stats = StreamingNormalizer().update(data)
+    data_mean = data_stats.mean.copy()
     data_mean[2] = 0
-    data_std = data.std(axis=0)
+    data_std = data_stats.std.copy()
     data_std[2] = 1
-    data_max = data.max(axis=0)
-    data_min = data.min(axis=0)
+    data_max = data_stats.max
+    data_min = data_stats.min
     
     # normalization of the data set
     #data = (data-data_mean)/data_std
     
     # spliting data set into training and test set. This is needed for the learning
     # task, since the future value of the birefringence will be predicted.
-    data_norm_K = 1 + 9*(d_dataset-data_min)/(data_max-data_min)
-    train_data_K = data_norm_K[0:seqlen_train,:]
-    test_data_K = data_norm_K[seqlen_train:seqlen,:]
-    
-    data_min32 = np.array(data_no_K.min(axis=0), dtype=np.float32)
-    data_max32 = np.array(data_no_K.max(axis=0), dtype=np.float32)
+    # The rows are scaled to 1 + 9*(x-min)/(max-min) only when the batches 
+    # index them, no scaled copy of the data set is kept
+    data_norm_K = data_stats.view(d_dataset, 'scale')
+    train_data_K = data_norm_K
+    test_data_K = data_norm_K
+    
+    # extrema of the normalized data set without K
+    data_min32 = np.array(data_no_K_stats.zscore(data_no_K_min), 
+                          dtype=np.float32)
+    data_max32 = np.array(data_no_K_stats.zscore(data_no_K_max), 
+                          dtype=np.float32)
     sess.run(angles_min.assign(data_min32[num_states-num_latent_var:]))
     sess.run(angles_max.assign(data_max32[num_states-num_latent_var:]))
     
@@ -2514,6 +2507,33 @@ with tf.Session() as sess:
 iter_data_2 = 0
 iter_through_dataset_2 = 1
 
+def train_starts(time_steps, batch_size):
+    """ valid starting indices of the training sequences of 2*time_steps 
+    time steps; next_batch advances by one index per batch and needs more 
+    than batch_size of them
+    """
+    starts = segment_starts(train_segments, 2*delay + 3, 2*time_steps + 1)
+    if len(starts) <= batch_size:
+        raise ValueError('%d training sequences of %d time steps fit into '
+                         'the training segments, a batch needs more than %d '
+                         '- increase data_chunksize' % (len(starts), 
+                                                        2*time_steps, 
+                                                        batch_size))
+    return starts
+
+def test_starts(time_steps, batch_size):
+    """ valid starting indices of the test sequences of 2*time_steps time
+    steps; the true states are shifted by one row (target_shift=1), which has
+    to stay in the test segment as well
+    """
+    starts = segment_starts(test_segments, 2*delay + 2, 2*time_steps)
+    if len(starts) < batch_size:
+        raise ValueError('%d test sequences of %d time steps fit into the '
+                         'test segments, a batch needs %d - increase '
+                         'data_chunksize' % (len(starts), 2*time_steps,
+                                             batch_size))
+    return starts
+
 def feed_inp(phase, time_steps,train_batch_size,train, num_batch = 0):
     """ Generating the feed_dict from the data set
     
@@ -2551,15 +2571,11 @@ def feed_inp(phase, time_steps,train_batch_size,train, num_batch = 0):
     #    inp_f_cur[t+1]
     
     # valid starting indices for training
-    batchdataindex = []
-    last = 0
-    for s in [seqlen_train]:
-            batchdataindex += range(last + 2*delay + 3,
-                                    last + s-train_batch_size-2*time_steps-1)
-            last += s
-    
-    permindex = np.array(batchdataindex)
-    np.random.shuffle(permindex)
+    if train:
+        batchdataindex = train_starts(time_steps, train_batch_size)
+        
+        permindex = np.array(batchdataindex)
+        np.random.shuffle(permindex)
     
         
     def next_batch(phase, train, time_steps, train_batch_size):
@@ -2573,59 +2589,11 @@ def feed_inp(phase, time_steps,train_batch_size,train, num_batch = 0):
                 print(iter_data_2)
                 print(iter_through_dataset_2)
                 np.random.shuffle(permindex)
-            batch_v_p_hist = np.zeros((2*time_steps,train_batch_size,
-                                       delay*num_parameters))
-            batch_v_p_cur = np.zeros((2*time_steps,train_batch_size,
-                                      num_parameters))
-            batch_v_hist = np.zeros((2*time_steps,train_batch_size,
-                                     delay*num_parameters))
-            batch_v_cur = np.zeros((2*time_steps,train_batch_size,
-                                    num_parameters))
-            batch_u_hist = np.zeros((2*time_steps,train_batch_size,
-                                     delay*num_wave_plates))
-            batch_u_cur = np.zeros((2*time_steps,train_batch_size,
-                                    num_wave_plates))
-            batch_u_comp_h = np.zeros((2*time_steps,train_batch_size,
-                                       delay*num_parameters))
-            batch_u_comp_c = np.zeros((2*time_steps,train_batch_size,
-                                      num_parameters))
-            batch_true = np.zeros((2*time_steps,train_batch_size,num_states))
-            for num in range(train_batch_size):
-                for t in range(2*time_steps):
-                    batch_v_p_hist[t,num,:] = train_data[permindex[
-                            iter_data_2 + num] - 2*delay-2 + t:permindex[
-                            iter_data_2 + num]-delay-2 + t,
-                            0:num_parameters].reshape([1,num_parameters*delay])
-                    batch_v_p_cur[t,num,:] = train_data[permindex[
-                            iter_data_2 + num]-delay-2 + t,
-                            0:num_parameters].reshape([1,num_parameters])
-                    batch_v_hist[t,num,:] = train_data[permindex[
-                            iter_data_2 + num] - delay-1 + t:permindex[
-                            iter_data_2 + num]-1 + t,0:num_parameters].reshape(
-                            [1,num_parameters*delay])
-                    batch_v_cur[t,num,:] = train_data[
-                            permindex[iter_data_2 + num]-1 + t,
-                            0:num_parameters].reshape([1,num_parameters])
-                    batch_u_hist[t,num,:] = train_data[
-                            permindex[iter_data_2 + num]-delay + \
-                            t:permindex[iter_data_2 + num] + t,
-                            num_states - num_latent_var:num_parameters].reshape(
-                            [1,num_wave_plates*delay])
-                    batch_u_cur[t,num,:] = train_data[
-                            permindex[iter_data_2 + num] + t,
-                            num_states - num_latent_var:num_parameters].reshape(
-                            [1,num_wave_plates])
-                    batch_u_comp_h[t,num,:] = train_data[
-                            permindex[iter_data_2 + num] - delay + t:permindex[
-                            iter_data_2 + num] + t,0:num_parameters].reshape(
-                            [1,num_parameters*delay])
-                    batch_u_comp_c[t,num,:] = train_data[
-                            permindex[iter_data_2 + num] + t,
-                            0:num_parameters].reshape([1,num_parameters])
-                    batch_true[t,num,:] = train_data_K[
-                            permindex[iter_data_2 + num] + t,
-                            0:num_states].reshape([1,num_states])
-                            #* data_std[:num_states]+data_mean[:num_states]
+            (batch_v_cur, batch_v_hist, batch_v_p_cur, batch_v_p_hist,
+             batch_u_cur, batch_u_hist, batch_u_comp_c, batch_u_comp_h,
+             batch_true) = window_batch(train_data, train_data_K,
+                    permindex[iter_data_2:iter_data_2 + train_batch_size],
+                    time_steps, delay, num_parameters, u_columns, num_states)
             
             iter_data_2 += 1
             
@@ -2642,77 +2610,18 @@ def feed_inp(phase, time_steps,train_batch_size,train, num_batch = 0):
                                           train_batch_size)
             else:
                 # valid starting indices for testing
-                testdataindex = range(2*delay+2,seqlen_test-2*time_steps+1)
-                
-                testindex = np.array(testdataindex)
-                np.random.shuffle(testindex)
+                testdataindex = test_starts(time_steps, train_batch_size)
                 
-                batch_v_cur = np.zeros((2*time_steps,train_batch_size,
-                                        num_parameters))
-                batch_v_hist = np.zeros((2*time_steps,train_batch_size,
-                                         delay*num_parameters))
-                batch_v_p_cur = np.zeros((2*time_steps,train_batch_size,
-                                          num_parameters))
-                batch_v_p_hist = np.zeros((2*time_steps,train_batch_size,
-                                           delay*num_parameters))
-                batch_u_cur = np.zeros((2*time_steps,train_batch_size,
-                                        num_wave_plates))
-                batch_u_hist = np.zeros((2*time_steps,train_batch_size,
-                                         delay*num_wave_plates))
-                batch_u_comp_c = np.zeros((2*time_steps,train_batch_size,
-                                      num_parameters))
-                batch_u_comp_h = np.zeros((2*time_steps,train_batch_size,
-                                           delay*num_parameters))
-                batch_true = np.zeros((2*time_steps,train_batch_size,
-                                       num_states))
-                for num in range(train_batch_size):
-                    for t in range(2*time_steps):
-                        batch_v_p_hist[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num +  t:num_batch * \
-                                      train_batch_size + num + delay + t,
-                                      0:num_parameters].reshape(
-                                      [1,num_parameters*delay])
-                        batch_v_p_cur[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + delay + t,
-                                      0:num_parameters].reshape(
-                                      [1,num_parameters])
-                        batch_v_hist[t,num,:] = test_data[num_batch * \
-                                     train_batch_size + num + delay + 1 + \
-                                     t:num_batch * train_batch_size + num + \
-                                     2*delay + 1 + t,
-                                     0:num_parameters].reshape(
-                                     [1,num_parameters*delay])
-                        batch_v_cur[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + 2*delay + 1 + t,
-                                      0:num_parameters].reshape(
-                                      [1,num_parameters])
-                        batch_u_hist[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + delay + 2 + \
-                                      t:num_batch * train_batch_size + num + \
-                                      2*delay + 2 + t,
-                                      num_states - num_latent_var:num_parameters].reshape(
-                                      [1,num_wave_plates*delay])
-                        batch_u_cur[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + 2*delay + 2 + t,
-                                      num_states - num_latent_var:num_parameters].reshape(
-                                      [1,num_wave_plates])
-                        batch_u_comp_h[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + delay + 2 + \
-                                      t:num_batch * train_batch_size + num + \
-                                      2*delay + 2 + t,
-                                      0:num_parameters].reshape(
-                                      [1,num_parameters*delay])
-                        batch_u_comp_c[t,num,:] = test_data[num_batch * \
-                                      train_batch_size + num + 2*delay + 3 + t,
-                                       0:num_parameters].reshape(
-                                       [1,num_parameters])
-                        # since the latent values from the variational
-                        # autoencoder results in small values with a even
-                        # smaller variance, we use the normalized values for
-                        batch_true[t,num,:] = test_data_K[num_batch * \
-                                   train_batch_size + num + 2*delay + 3 + t,
-                                   0:num_states].reshape([1,num_states])
-                                    #* data_std[:num_states]+data_mean[:num_states]
+                # the latent values from the variational autoencoder result
+                # in small values with an even smaller variance, the
+                # normalized values are used for batch_true
+                (batch_v_cur, batch_v_hist, batch_v_p_cur, batch_v_p_hist,
+                 batch_u_cur, batch_u_hist, batch_u_comp_c, batch_u_comp_h,
+                 batch_true) = window_batch(test_data, test_data_K,
+                        testdataindex[num_batch*train_batch_size + 
+                                      np.arange(train_batch_size)],
+                        time_steps, delay, num_parameters, u_columns, 
+                        num_states, target_shift=1)
             
             inp = np.concatenate((batch_v_p_hist, batch_v_p_cur, batch_v_hist,
                                   batch_v_cur,  batch_u_hist, batch_u_cur),
@@ -2790,7 +2699,7 @@ def one_step():
     max_err = 100000
     err_temp = err_testset
     max_err_temp = max_err
-    total_batch = int(seqlen_test / test_batch_1)
+    total_batch = len(test_starts(steps_phase_1, test_batch_1))//test_batch_1
     #for i in range(FLAGS.max_steps):
     while(i < FLAGS.max_steps_1 and err_testset > 5e-5 and max_err > 1e-3):
         if i % 200 == 0:  # Record summaries and test-set accuracy
@@ -2956,7 +2865,7 @@ def ten_steps():
     max_err = 100000
     err_temp = err_testset
     max_err_temp = max_err
-    total_batch = int(seqlen_test / test_batch_1) - 1
+    total_batch = len(test_starts(steps_phase_2, test_batch_2))//test_batch_2
     #for epoch in range(FLAGS.max_steps):
     while(epoch < FLAGS.max_steps_10 and err_testset > 1e-3 and max_err > 1e-1):
             if (epoch) % 200 == 0:  # Record summaries and test-set accuracy
@@ -3111,6 +3020,18 @@ def control_pred(Ks, pre_learning=True):
     vt=np.fft.fft(v).reshape(n,)        # electrical fields
     uvt=np.concatenate([ut, vt], axis=0)# concatenation of ut and vt
     
+    # plant of the control: persistent cavity or independent simulations. The
+    # cavity settles into the steady state of the first configuration (up to
+    # Rnd round trips as laser_simulation) before it follows the control.
+    # Only the applied control inputs advance the cavity (plant), retries and
+    # comparisons are evaluated without changing it (probe)
+    if virtual_laser:
+        plant = VirtualLaser(uvt, settle_round_trips=Rnd)
+        probe = plant.probe
+    else:
+        plant = laser_simulation
+        probe = laser_simulation
+    
     # If it is not the pre learning for the controlling, the initial feed_dict
     # has to be determined. Here for the first (2*delay + 2 + stepsphase_crtl) 
     # time steps, the states of the laser have to be calculated using the 
@@ -3135,8 +3056,8 @@ def control_pred(Ks, pre_learning=True):
             alpha = alpha_norm*K_u_std[1:5]+K_u_mean[1:5]
             
             
-            (_,states) = laser_simulation(uvt, alpha[0,0], alpha[0,1], 
-                                          alpha[0,2], alpha[0,3], K_sim[t])
+            (_,states) = plant(uvt, alpha[0,0], alpha[0,1], 
+                               alpha[0,2], alpha[0,3], K_sim[t])
             
             print('Laser states: %s' % states)
             z_vae = vae.transform(np.reshape(states,[1,num_parameters]))
@@ -3337,6 +3258,11 @@ def control_pred(Ks, pre_learning=True):
         
         res_past = 0.0
         
+        # the adjustment below applies its inputs from the same state of the
+        # cavity
+        if virtual_laser:
+            plant_state = plant.snapshot()
+        
         # Denormalization of the angles
         for angle, t in zip(angles,range(steps_phase_crtl)):
             ang = []
@@ -3350,33 +3276,39 @@ def control_pred(Ks, pre_learning=True):
                     ang.append(angle[0][a])
                     
                 # Run simulations using identified angles
-                (_,states) = laser_simulation(uvt, ang[0], ang[1], ang[2], 
-                                              ang[3], K_simu)
+                configuration = (ang[0], ang[1], ang[2], ang[3], K_simu)
+                (_,states) = probe(uvt, *configuration)
                 
-                return states
+                return states, configuration
             
-            states = run_sim(angle, K_simulation[t])
+            (states, applied) = run_sim(angle, K_simulation[t])
             
             res_current = states[0]/states[1]
             
             if (t > 0 and res_past - res_current > 0.015):
                 angle = angles[t-1]
-                states_temp = run_sim(angle, K_simulation[t])
+                (states_temp, configuration) = run_sim(angle, 
+                                                       K_simulation[t])
                 
                 res_new = states_temp[0]/states_temp[1]
                 
                 if res_new > res_current:
                     states = states_temp
+                    applied = configuration
                     res_past = res_new
                     
             if ((t == 1 or t == steps_phase_crtl - 1) 
               and res_current - res_past > 0.015):
-                states_temp = run_sim(angle, K_simulation[t-1])
+                (states_temp, _) = run_sim(angle, K_simulation[t-1])
                 
                 res_0 = states_temp[0]/states_temp[1]
                 
                 if res_0 > res_past:
                     laser_states[0] = states_temp
+            
+            # the chosen input is applied to the laser
+            if virtual_laser:
+                plant(uvt, *applied)
                     
             z_vae = vae.transform(np.reshape(states,[1,num_parameters]))
             K_vae = (z_vae - z_mu_mean)/z_mu_std
@@ -3393,6 +3325,9 @@ def control_pred(Ks, pre_learning=True):
         if test_err > 1.25:
             print('Adjusting since error is too large')
             laser_states = []
+            # the adjusted inputs replace the ones applied above
+            if virtual_laser:
+                plant.restore(plant_state)
             for t in range(steps_phase_crtl):
                 alpha_norm = np.vstack(sess.run([layer[-1]],
                                 feed_dict={K: np.reshape(ks[t],[1,1])}))[0]
@@ -3403,17 +3338,17 @@ def control_pred(Ks, pre_learning=True):
                 sess.run(control_input[t].assign(np.reshape(alpha_inp,
                                                        [1,num_wave_plates])))
                 
-                (_,states) = laser_simulation(uvt,alpha[0], alpha[1], alpha[2], 
-                                              alpha[3], K_simulation[t])
+                (_,states) = probe(uvt,alpha[0], alpha[1], alpha[2], 
+                                   alpha[3], K_simulation[t])
                 
                 res_current = states[0]/states[1]
             
                 if (t > 0 and res_past - res_current > 0.015):
                     print('Res_past: %s, Res_current: %s, diff = %s' % (res_past, res_current, res_past - res_current))
                     angle = alpha_past.copy()
-                    (_, states_temp) = laser_simulation(uvt,angle[0], angle[1],
-                                                        angle[2], angle[3], 
-                                                        K_simulation[t])
+                    (_, states_temp) = probe(uvt,angle[0], angle[1],
+                                             angle[2], angle[3], 
+                                             K_simulation[t])
                     
                     res_new = states_temp[0]/states_temp[1]
                     
@@ -3426,9 +3361,9 @@ def control_pred(Ks, pre_learning=True):
                 if ((t == 1 or t == steps_phase_crtl - 1) 
                   and res_current - res_past > 0.015):
                     print('Res_past: %s, Res_current: %s, diff = %s' % (res_past, res_current, res_past - res_current))
-                    (_,states_temp) = laser_simulation(uvt,alpha[0], alpha[1], 
-                                                       alpha[2], alpha[3], 
-                                                       K_simulation[t-1])
+                    (_,states_temp) = probe(uvt,alpha[0], alpha[1], 
+                                            alpha[2], alpha[3], 
+                                            K_simulation[t-1])
                     
                     res_0 = states_temp[0]/states_temp[1]
                     
@@ -3436,6 +3371,11 @@ def control_pred(Ks, pre_learning=True):
                         print('Res_past: %s, Res_0: %s' % (res_past, res_0))
                         laser_states[0] = states_temp
                         
+                # the chosen input is applied to the laser
+                if virtual_laser:
+                    plant(uvt, alpha[0], alpha[1], alpha[2], alpha[3], 
+                          K_simulation[t])
+                
                 alpha_past = alpha.copy()
                     
                 laser_states.append(states)
@@ -3671,6 +3611,9 @@ if a:
     
     control_pred(K_steps, pre_learning=False)
     
+    print('Simulation cache: %s' % simulation_cache.stats())
+    simulation_cache.close()
+    
     train_writer_cnt.close()
     train_writer_cnt_2.close()
     train_writer_3.close()
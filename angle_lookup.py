@@ -0,0 +1,202 @@
+"""
+Lookup of good angles for a given birefringence
+
+KIndex sorts the data set by the birefringence representation K once and
+builds a sparse table for range-argmax queries of the objective function
+E/M4. Each query "best data point with K in [k - dx, k + dx]" then costs two
+binary searches and two table lookups, and all queries are answered in one
+vectorized call. k_u_training_set turns the selected data points into the
+training and test set of the K-u mapping.
+"""
+
+import numpy as np
+
+
+class KIndex(object):
+    """ Sorted K values with a sparse table of the objective """
+    def __init__(self, k_values, objective, K_lb=None, K_ub=None, dx=None):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        k_values:   array, shape=[N,]
+                    birefringence representation of each data point
+        objective:  array, shape=[N,]
+                    objective function value (E/M4) of each data point
+        K_lb, K_ub: float
+                    bounds of the birefringence (default: min/max of k_values)
+        dx:         float
+                    half width of the search interval, default (K_ub-K_lb)/50
+        """
+        self.k_values = np.asarray(k_values, dtype=float)
+        self.objective = np.asarray(objective, dtype=float)
+        self.K_lb = self.k_values.min() if K_lb is None else K_lb
+        self.K_ub = self.k_values.max() if K_ub is None else K_ub
+        self.dx = (self.K_ub - self.K_lb)/50 if dx is None else dx
+
+        # stable sort: data points with the same K keep their order
+        self.order = np.argsort(self.k_values, kind='mergesort')
+        self.sorted_k = self.k_values[self.order]
+
+        # sparse table: table[j][i] is the position (in sorted order) of the
+        # best data point in [i, i + 2**j)
+        positions = np.arange(len(self.order))
+        self.table = [positions]
+        width = 1
+        while 2*width <= len(positions):
+            prev = self.table[-1]
+            self.table.append(self._better(prev[:-width], prev[width:]))
+            width *= 2
+
+    def _better(self, a, b):
+        # positions with the larger objective - ties go to the data point
+        # with the smaller index in the data set (first occurrence)
+        obj_a = self.objective[self.order[a]]
+        obj_b = self.objective[self.order[b]]
+        take_b = (obj_b > obj_a) | ((obj_b == obj_a) &
+                                    (self.order[b] < self.order[a]))
+        return np.where(take_b, b, a)
+
+    def range_argmax(self, lo, hi):
+        """ index in the data set of the best data point within the sorted
+        positions [lo, hi) of every query, -1 for empty ranges
+        """
+        lo = np.asarray(lo)
+        hi = np.asarray(hi)
+        empty = hi <= lo
+        length = np.where(empty, 1, hi - lo)
+        level = np.floor(np.log2(length)).astype(int)
+        lo = np.where(empty, 0, lo)
+        hi = np.where(empty, 1, hi)
+
+        best = np.empty(len(lo), dtype=int)
+        for j in np.unique(level):
+            sel = level == j
+            best[sel] = self._better(self.table[j][lo[sel]],
+                                     self.table[j][hi[sel] - 2**j])
+        return np.where(empty, -1, self.order[best])
+
+    def query(self, k):
+        """ Best data point within the interval around each k
+
+        Same selection as DeepMPC.get_angles: inside [K_lb + dx, K_ub - dx]
+        the open interval (k - dx, k + dx) is searched, near the bounds it is
+        clipped to [K_lb, k + dx) or (k - dx, K_ub]. Only data points with a
+        positive objective count.
+
+        Parameters
+        ----------------------------------------------------------------------
+        k:          array, shape=[M,]
+                    queried birefringence values
+
+        Returns
+        ----------------------------------------------------------------------
+        index:      array, shape=[M,]
+                    index of the best data point, 0 if there is none
+        obj:        array, shape=[M,]
+                    its objective function value, the maximum of the whole
+                    data set if there is none
+        ks:         array, shape=[M,]
+                    its birefringence, k if there is none (or if index is 0)
+        """
+        k = np.atleast_1d(np.asarray(k, dtype=float))
+        dx = self.dx
+        middle = (k > self.K_lb + dx) & (k < self.K_ub - dx)
+        lower = ~middle & (k < self.K_lb + dx)
+        upper = ~middle & ~lower & (k > self.K_ub - dx)
+
+        lo = np.where(lower,
+                      np.searchsorted(self.sorted_k, self.K_lb, 'left'),
+                      np.searchsorted(self.sorted_k, k - dx, 'right'))
+        hi = np.where(upper,
+                      np.searchsorted(self.sorted_k, self.K_ub, 'right'),
+                      np.searchsorted(self.sorted_k, k + dx, 'left'))
+        # k exactly on K_lb + dx or K_ub - dx selects nothing
+        hi = np.where(middle | lower | upper, hi, lo)
+
+        index = self.range_argmax(lo, hi)
+        found = index >= 0
+        found[found] = self.objective[index[found]] > 0
+        index = np.where(found, index, 0)
+
+        obj = np.where(found, self.objective[index], self.objective.max())
+        ks = np.where(found & (index > 0), self.k_values[index], k)
+
+        return index, obj, ks
+
+
+def k_u_training_set(ks, angles, k_diff, obj, max_gradient=1.0, n_interp=1000):
+    """ Training and test set of the K-u mapping
+
+    The best data points found by KIndex.query are sorted by the
+    birefringence (then by descending objective and descending distance to
+    the queried value); of every group with the same birefringence only the
+    last row is kept. Between neighbouring rows whose normalized gradient is
+    smaller than max_gradient, n_interp linearly interpolated rows are added.
+    Every third row goes into the test set.
+
+    Parameters
+    --------------------------------------------------------------------------
+    ks:         array, shape=[M,]
+                birefringence of the selected data points
+    angles:     array, shape=[M, num_wave_plates]
+                angles of the selected data points
+    k_diff:     array, shape=[M,]
+                distance between ks and the queried birefringence
+    obj:        array, shape=[M,]
+                objective function values of the selected data points
+    max_gradient:
+                float
+                rows are only interpolated where the gradient is smaller
+    n_interp:   int
+                number of interpolated rows per gap
+
+    Returns
+    --------------------------------------------------------------------------
+    K_u_list:   array, shape=[L, num_wave_plates + 2]
+                normalized rows [K, angles, obj]
+    K_u_mean, K_u_std:
+                arrays, shape=[num_wave_plates + 2,]
+                statistics used for the normalization (K is not normalized)
+    K_u_train:  array, shape=[(L//3)*2 + 1, num_wave_plates + 1]
+    K_u_test:   array, shape=[L//3, num_wave_plates + 1]
+                rows [K, angles] of the training and test set
+    """
+    ks = np.asarray(ks, dtype=float)
+    k_diff = np.asarray(k_diff, dtype=float)
+    obj = np.asarray(obj, dtype=float)
+
+    # sort by K, then by descending objective, then by descending distance
+    order = np.lexsort((-k_diff, -obj, ks))
+    rows = np.column_stack((ks, angles, obj))[order]
+
+    # delete duplicates, the last row of every group of equal K is kept
+    keep = np.append(rows[1:, 0] != rows[:-1, 0], True)
+    rows = rows[keep]
+
+    # calculate mean, stddev, and the gradients of the rows
+    K_u_mean = rows.mean(axis=0)
+    K_u_std = rows.std(axis=0)
+    K_u_mean[0] = 0
+    K_u_std[0] = 1
+    K_u_grad = np.gradient((rows - K_u_mean)/K_u_std, axis=0)
+
+    # every row (except the last one) is followed by n_interp interpolated
+    # rows towards the next one if the gradient is small enough
+    interp = np.max(np.abs(K_u_grad[:-1]), axis=1) < max_gradient
+    counts = 1 + n_interp*interp
+    start = np.repeat(np.arange(len(rows) - 1), counts)
+    m = np.arange(len(start)) - np.repeat(np.cumsum(counts) - counts, counts)
+    diff = rows[1:] - rows[:-1]
+    K_u_list = rows[start] + m[:, np.newaxis]*diff[start]/float(n_interp)
+
+    K_u_list = (K_u_list - K_u_mean)/K_u_std
+
+    # split into training and test set - two of every three rows are used
+    # for training, the last row is always a training row
+    L = len(K_u_list)
+    blocks = K_u_list[:3*(L//3), :-1].reshape(L//3, 3, -1)
+    K_u_train = np.concatenate((blocks[:, :2].reshape(2*(L//3), -1),
+                                K_u_list[-1:, :-1]), axis=0)
+    K_u_test = blocks[:, 2].copy()
+
+    return K_u_list, K_u_mean, K_u_std, K_u_train, K_u_test
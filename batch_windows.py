@@ -0,0 +1,207 @@
+"""
+Vectorized construction of the training and test batches of DeepMPC
+
+A batch consists of 2*time_steps consecutive time steps for each of its
+sequences. For every time step the network gets the history of the last
+`delay` rows and the current row of three consecutive blocks of the data
+(past, current and future inputs). Instead of copying each window with a
+slice, all windows are taken from a strided view of the data
+(sliding_window_view) with one fancy index per block.
+
+chunked_split divides the rows into a training and a test set by chunks of
+rows instead of one cut at 70 % of the data set, so both sets cover the
+whole data set (the simulation parameters drift along it) and a data set
+which is read in chunks can be split without knowing its length in advance.
+The sequences of a batch are drawn from segment_starts of the segments, no
+sequence crosses the border of a segment.
+"""
+
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def window_batch(data, data_K, starts, time_steps, delay, num_parameters,
+                 u_columns, num_states, target_shift=0):
+    """ Windows of all sequences of a batch
+
+    A sequence starting at row s uses (for its time step t, with r = s + t)
+        v_p_hist:   rows [r-2*delay-2, r-delay-2)   v_p_cur:  row r-delay-2
+        v_hist:     rows [r-delay-1, r-1)           v_cur:    row r-1
+        u_hist:     rows [r-delay, r), u_columns    u_cur:    row r, u_columns
+        u_comp_h:   rows [r-delay, r)               u_comp_c: row r+shift
+        true:       row r+shift of data_K           (shift = target_shift)
+    the windows of several rows are flattened row by row.
+
+    Parameters
+    --------------------------------------------------------------------------
+    data:       array, shape=[N, >=num_parameters]
+                normalized data set
+    data_K:     array, shape=[N, >=num_states]
+                data set of the true states
+    starts:     array, shape=[batch_size,]
+                row s of each sequence
+    time_steps: int
+                the sequences are 2*time_steps long
+    delay:      int
+                length of the histories
+    num_parameters:
+                int
+                number of columns of the v and u_comp windows
+    u_columns:  slice
+                columns of the u windows
+    num_states: int
+                number of columns of the true states
+    target_shift:
+                int
+                offset of u_comp_c and the true states
+
+    Returns
+    --------------------------------------------------------------------------
+    (batch_v_cur, batch_v_hist, batch_v_p_cur, batch_v_p_hist, batch_u_cur,
+     batch_u_hist, batch_u_comp_c, batch_u_comp_h, batch_true)
+                arrays, shape=[2*time_steps, batch_size, ...]
+    """
+    v = data[:, :num_parameters]
+    u = data[:, u_columns]
+    # windows[i] are the rows [i, i+delay), shape=[N-delay+1, columns, delay]
+    v_windows = sliding_window_view(v, delay, axis=0)
+    u_windows = sliding_window_view(u, delay, axis=0)
+
+    # r[t, num] = starts[num] + t
+    r = np.arange(2*time_steps)[:, np.newaxis] + np.asarray(starts)
+
+    def history(windows, first):
+        # [steps, batch, columns, delay] -> [steps, batch, delay*columns]
+        h = windows[first].swapaxes(-1, -2)
+        return h.reshape(h.shape[:2] + (-1,))
+
+    batch_v_p_hist = history(v_windows, r - 2*delay - 2)
+    batch_v_p_cur = v[r - delay - 2]
+    batch_v_hist = history(v_windows, r - delay - 1)
+    batch_v_cur = v[r - 1]
+    batch_u_hist = history(u_windows, r - delay)
+    batch_u_cur = u[r]
+    batch_u_comp_h = history(v_windows, r - delay)
+    batch_u_comp_c = v[r + target_shift]
+    batch_true = data_K[r + target_shift, :num_states]
+
+    return (batch_v_cur, batch_v_hist, batch_v_p_cur, batch_v_p_hist,
+            batch_u_cur, batch_u_hist, batch_u_comp_c, batch_u_comp_h,
+            batch_true)
+
+
+def chunked_split(n_rows, chunksize=None, train_fraction=0.7):
+    """ Division of the rows into a training and a test set
+
+    Parameters
+    --------------------------------------------------------------------------
+    n_rows:     int
+                number of rows of the data set
+    chunksize:  int
+                the chunks of chunksize rows are assigned alternately, in the
+                proportion train_fraction, to the two sets (chunk i belongs
+                to the training set if ceil((i+1)*train_fraction) >
+                ceil(i*train_fraction)); None: the first int(train_fraction*
+                n_rows) rows are the training set, the others the test set
+    train_fraction:
+                float
+                fraction of the chunks of the training set
+
+    Returns
+    --------------------------------------------------------------------------
+    train_segments, test_segments:
+                lists of (start, stop) of the rows of the two sets, adjacent
+                chunks of a set are merged into one segment
+    """
+    if chunksize is None:
+        cut = int(train_fraction*n_rows)
+        return [(0, cut)], [(cut, n_rows)]
+
+    segments = ([], [])
+    for i, start in enumerate(range(0, n_rows, chunksize)):
+        stop = min(start + chunksize, n_rows)
+        train = np.ceil((i + 1)*train_fraction) > np.ceil(i*train_fraction)
+        target = segments[0] if train else segments[1]
+        if target and target[-1][1] == start:
+            target[-1] = (target[-1][0], stop)
+        else:
+            target.append((start, stop))
+    return segments
+
+
+def segment_starts(segments, before, after):
+    """ rows s of the segments with start + before <= s < stop - after, e.g.
+    the first rows of the sequences which fit into a segment
+    """
+    starts = [np.arange(start + before, stop - after)
+              for start, stop in segments]
+    return np.concatenate(starts) if starts else np.zeros(0, dtype=int)
+
+
+def _loop_batch(data, data_K, starts, time_steps, delay, num_parameters,
+                u_columns, num_states, target_shift=0):
+    # former implementation: one slice per window, time step and sequence
+    shape = (2*time_steps, len(starts))
+    num_u = len(range(*u_columns.indices(data.shape[1])))
+    batch = [np.zeros(shape + (cols,)) for cols in
+             (num_parameters, delay*num_parameters, num_parameters,
+              delay*num_parameters, num_u, delay*num_u, num_parameters,
+              delay*num_parameters, num_states)]
+    for num in range(len(starts)):
+        for t in range(2*time_steps):
+            r = starts[num] + t
+            c = r + target_shift
+            batch[0][t, num, :] = data[r-1, 0:num_parameters]
+            batch[1][t, num, :] = data[r-delay-1:r-1,
+                                       0:num_parameters].reshape(-1)
+            batch[2][t, num, :] = data[r-delay-2, 0:num_parameters]
+            batch[3][t, num, :] = data[r-2*delay-2:r-delay-2,
+                                       0:num_parameters].reshape(-1)
+            batch[4][t, num, :] = data[r, u_columns]
+            batch[5][t, num, :] = data[r-delay:r, u_columns].reshape(-1)
+            batch[6][t, num, :] = data[c, 0:num_parameters]
+            batch[7][t, num, :] = data[r-delay:r,
+                                       0:num_parameters].reshape(-1)
+            batch[8][t, num, :] = data_K[c, 0:num_states]
+    return tuple(batch)
+
+
+def benchmark_window_batch(N=10000, batch_size=100, time_steps=10, delay=5,
+                           num_states=3, num_latent_var=1, num_wave_plates=4,
+                           batches=200):
+    """ batches per second of window_batch and of the former loop with one
+    slice per window
+    """
+    num_parameters = num_states + num_wave_plates - num_latent_var
+    u_columns = slice(num_states - num_latent_var, num_parameters)
+    data = np.random.randn(N, num_parameters + 1)
+    data_K = np.random.randn(N, num_states)
+    starts = np.random.randint(2*delay + 3, N - 2*time_steps - 1,
+                               size=(batches, batch_size))
+    args = (time_steps, delay, num_parameters, u_columns, num_states)
+
+    for a, b in zip(_loop_batch(data, data_K, starts[0], *args),
+                    window_batch(data, data_K, starts[0], *args)):
+        assert np.array_equal(a, b)
+
+    loops = max(batches//20, 1)
+    start = time.time()
+    for s in starts[:loops]:
+        _loop_batch(data, data_K, s, *args)
+    loop_rate = loops/(time.time() - start)
+
+    start = time.time()
+    for s in starts:
+        window_batch(data, data_K, s, *args)
+    vectorized_rate = batches/(time.time() - start)
+
+    print('loop:         %.1f batches/s' % loop_rate)
+    print('window_batch: %.1f batches/s' % vectorized_rate)
+
+    return loop_rate, vectorized_rate
+
+
+if __name__ == "__main__":
+    benchmark_window_batch()
@@ -0,0 +1,194 @@
+"""
+Binary cache of the data sets stored as workbooks
+
+Parsing an .xlsx workbook with xlrd takes seconds for the simulation data
+sets and is repeated on every run. load_array converts a workbook (first
+sheet) or a .csv file once into an .npy file and opens the .npy file as a
+memory map afterwards, which takes milliseconds and does not copy the data.
+
+The cache directory holds one .npy file per source and manifest.json, which
+records for each source its modification time, size and sha1 hash. A source
+whose mtime and size are unchanged is not read at all; if only the mtime
+changed, the hash decides whether the conversion is repeated.
+
+iter_chunks reads a data set in chunks of rows for code which works out of
+core (e.g. normalization.StreamingNormalizer.from_chunks): .csv files are
+parsed chunk by chunk, .npy files and workbooks (through the cache) are
+memory mapped and sliced. A .csv file is converted into the cache chunk by
+chunk as well, so neither needs the whole data set in memory.
+"""
+
+import os
+import json
+import hashlib
+from itertools import islice
+
+import numpy as np
+
+# default cache directory, next to the data sets
+cache_dir = '.dataset_cache'
+
+
+def read_table(filename):
+    """ all rows of the first sheet of a workbook (.xlsx, .xls) or of a .csv
+    file as a 2D float array
+    """
+    if filename.lower().endswith('.csv'):
+        return np.atleast_2d(np.loadtxt(filename, delimiter=',', ndmin=2))
+
+    import xlrd
+    worksheet = xlrd.open_workbook(filename).sheet_by_index(0)
+    # one stack of all columns instead of a concatenation per column
+    return np.column_stack([np.asarray(worksheet.col_values(i), dtype=float)
+                            for i in range(worksheet.row_len(0))])
+
+
+def _csv_chunks(filename, chunksize):
+    # the lines of a chunk are parsed at once, the file is read sequentially
+    with open(filename) as f:
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=',', ndmin=2)
+
+
+def _convert_csv(filename, path, chunksize=65536):
+    # first pass: number of rows, second pass: rows into the .npy file
+    with open(filename) as f:
+        rows = sum(1 for line in f if line.strip())
+    data = None
+    start = 0
+    for chunk in _csv_chunks(filename, chunksize):
+        if data is None:
+            data = np.lib.format.open_memmap(path, mode='w+', dtype=float,
+                                             shape=(rows, chunk.shape[1]))
+        data[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    if data is None:
+        np.save(path, np.zeros((0, 0)))
+        return (0, 0)
+    data.flush()
+    return data.shape
+
+
+def iter_chunks(filename, chunksize=65536, directory=None):
+    """ Rows of a data set in chunks
+
+    Parameters
+    --------------------------------------------------------------------------
+    filename:   string
+                .csv (parsed chunk by chunk), .npy (memory mapped) or a
+                workbook .xlsx, .xls (memory mapped from the cache, see
+                load_array)
+    chunksize:  int
+                number of rows per chunk (the last one may be shorter)
+    directory:  string
+                cache directory of workbooks (default: module parameter
+                cache_dir)
+
+    Yields
+    --------------------------------------------------------------------------
+    chunk:      array, shape=[<=chunksize, columns]
+                the next rows; slices of a memory map are views, copy them
+                to keep them
+    """
+    if filename.lower().endswith('.csv'):
+        for chunk in _csv_chunks(filename, chunksize):
+            yield chunk
+        return
+    if filename.lower().endswith('.npy'):
+        data = np.load(filename, mmap_mode='r')
+    else:
+        data = load_array(filename, directory, mmap_mode='r')
+    for start in range(0, len(data), chunksize):
+        yield data[start:start + chunksize]
+
+
+def _file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(directory, manifest):
+    # replace the file atomically, it is either the old or the new version
+    path = os.path.join(directory, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def load_array(filename, directory=None, mmap_mode='c'):
+    """ Data of a workbook or .csv file through the binary cache
+
+    Parameters
+    --------------------------------------------------------------------------
+    filename:   string
+                .xlsx, .xls or .csv file
+    directory:  string
+                cache directory (default: module parameter cache_dir)
+    mmap_mode:  string
+                mode of the memory map (np.load): 'c' (default) allows to
+                modify the returned array without changing the cache, 'r' is
+                read-only
+
+    Returns
+    --------------------------------------------------------------------------
+    data:       array (2D), memory mapped
+                data of the first sheet
+    """
+    directory = cache_dir if directory is None else directory
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    source = os.path.abspath(filename)
+    stat = os.stat(source)
+    manifest = _read_manifest(directory)
+    entry = manifest.get(source)
+
+    if entry is not None and \
+       os.path.exists(os.path.join(directory, entry['array'])):
+        if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return np.load(os.path.join(directory, entry['array']),
+                           mmap_mode=mmap_mode)
+        digest = _file_hash(source)
+        if digest == entry['sha1']:
+            # touched but not changed
+            entry['mtime'] = stat.st_mtime
+            _write_manifest(directory, manifest)
+            return np.load(os.path.join(directory, entry['array']),
+                           mmap_mode=mmap_mode)
+    else:
+        digest = _file_hash(source)
+
+    # convert the source; the name of the array is unique per source path
+    array = '%s_%s.npy' % (os.path.splitext(os.path.basename(source))[0],
+                           hashlib.sha1(source.encode()).hexdigest()[:8])
+    path = os.path.join(directory, array)
+    if source.lower().endswith('.csv'):
+        shape = _convert_csv(source, path + '.tmp.npy')
+    else:
+        data = read_table(source)
+        shape = data.shape
+        np.save(path + '.tmp.npy', data)
+    os.replace(path + '.tmp.npy', path)
+
+    # other processes may have added entries in the meantime
+    manifest = _read_manifest(directory)
+    manifest[source] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                        'sha1': digest, 'array': array,
+                        'shape': list(shape)}
+    _write_manifest(directory, manifest)
+
+    return np.load(path, mmap_mode=mmap_mode)
@@ -0,0 +1,229 @@
+"""
+Parallel generation of laser simulation data sets
+
+The configurations (alpha1, alpha2, alpha3, alphap, K) are split into chunks
+which are simulated by a pool of worker processes. Every worker writes the
+states of its chunk into a checkpoint file as soon as the chunk is finished.
+The main process merges the finished chunks into a columnar store (one .npy
+file per column, opened as memory map) and removes the checkpoints, so an
+interrupted run continues with the chunks which are missing.
+
+Layout of the output directory:
+    configurations.npy      inputs of the run, shape=[N, 5]
+    E.npy, M4.npy, alpha1.npy, alpha2.npy, alpha3.npy, alphap.npy
+                            one column of the states per file, shape=[N,]
+    locked.npy              flag per configuration whether it mode-locked
+    done.npy                flag per chunk whether it was merged
+    chunk_<i>.npy           checkpoints of finished, not yet merged chunks
+
+On platforms which start the workers with 'spawn' (Windows), call
+generate_dataset from a script guarded by `if __name__ == "__main__":`
+(e.g. `python dataset_generation.py configurations.npy out_dir`). Processes
+with threads of their own (e.g. a tensorflow session) should not fork the
+pool either; they run the command line in a new interpreter instead.
+
+An output directory belongs to one set of configurations. run_directory
+names the directory of a set by its hash, so a changed set starts a new run
+instead of conflicting with the one of the previous set.
+"""
+
+import os
+import hashlib
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from mlock_CNLS import (laser_simulation, sech_field, ConvergenceMonitor,
+                        RelativeNorm, abort_criteria)
+
+# columns of the states returned by laser_simulation
+columns = ['E', 'M4', 'alpha1', 'alpha2', 'alpha3', 'alphap']
+
+
+def run_directory(base_dir, configurations):
+    """ output directory of the run of configurations [N, 5] below base_dir,
+    named by the hash of the configurations
+    """
+    configurations = np.ascontiguousarray(configurations, dtype=np.float64)
+    return os.path.join(base_dir, 'run_%s' % hashlib.sha1(
+        configurations.tobytes()).hexdigest()[:16])
+
+
+def _chunk_path(out_dir, chunk):
+    return os.path.join(out_dir, 'chunk_%06d.npy' % chunk)
+
+
+def _simulate_chunk(out_dir, chunk, configurations, uvt, engine,
+                    early_abort):
+    """ Worker: simulates one chunk of configurations and checkpoints the
+    resulting states (and the locked flag as last column) to disk
+    """
+    criteria = [RelativeNorm()]
+    if early_abort:
+        criteria += abort_criteria()
+    monitor = ConvergenceMonitor(criteria)
+
+    states = []
+    for config in configurations:
+        (_, state) = laser_simulation(uvt, *config, engine=engine,
+                                      monitor=monitor)
+        states.append(np.append(state, monitor.locked))
+
+    # write to a temporary file first, a checkpoint is either complete or
+    # not there at all
+    path = _chunk_path(out_dir, chunk)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.vstack(states))
+    os.replace(path + '.tmp', path)
+
+    return chunk
+
+
+def _open_columns(out_dir, N, mode):
+    return [np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'),
+                                      mode=mode, dtype=np.float64, shape=(N,))
+            for name in columns]
+
+
+def load_dataset(out_dir):
+    """ Memory map the states of a generated data set
+
+    Parameters
+    --------------------------------------------------------------------------
+    out_dir:    string
+                output directory of generate_dataset
+
+    Returns
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+                simulated (alpha1, alpha2, alpha3, alphap, K)
+    states:     list
+                one memory mapped column per entry of `columns`
+    locked:     array, shape=[N,]
+                bool, whether the configuration mode-locked
+    """
+    configurations = np.load(os.path.join(out_dir, 'configurations.npy'),
+                             mmap_mode='r')
+    states = [np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r')
+              for name in columns]
+    locked = np.load(os.path.join(out_dir, 'locked.npy'), mmap_mode='r')
+
+    return configurations, states, locked
+
+
+def generate_dataset(configurations, out_dir, uvt=None, chunksize=16,
+                     max_workers=None, engine='dop853', early_abort=False):
+    """ Simulates all configurations in parallel
+
+    Parameters
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+                (alpha1, alpha2, alpha3, alphap, K) of each simulation
+    out_dir:    string
+                directory of the columnar output and the checkpoints. If it
+                already contains a run with the same configurations, only the
+                missing chunks are simulated.
+    uvt:        array, shape=[2*n,]
+                initial fields (fourier space), default: sech pulse
+    chunksize:  int
+                number of configurations per task of a worker
+    max_workers:
+                int
+                number of worker processes (default: number of cpus)
+    engine:     string
+                engine of laser_simulation
+    early_abort:
+                bool
+                abort configurations which do not mode-lock (see
+                mlock_CNLS.abort_criteria) instead of simulating all Rnd
+                round trips; their states are the ones at the abort
+
+    Returns
+    --------------------------------------------------------------------------
+    states:     array, shape=[N, 6]
+                [E, M4, alpha1, alpha2, alpha3, alphap] of each configuration
+    """
+    configurations = np.asarray(configurations, dtype=np.float64)
+    N = len(configurations)
+    n_chunks = (N + chunksize - 1)//chunksize
+    if uvt is None:
+        uvt = sech_field()
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    config_path = os.path.join(out_dir, 'configurations.npy')
+    done_path = os.path.join(out_dir, 'done.npy')
+    locked_path = os.path.join(out_dir, 'locked.npy')
+
+    if os.path.exists(config_path):
+        # resume an interrupted run
+        stored = np.load(config_path)
+        done = np.lib.format.open_memmap(done_path, mode='r+')
+        if not np.array_equal(stored, configurations) or \
+           len(done) != n_chunks:
+            raise ValueError('%s contains a run with different configurations'
+                             ' or chunksize' % out_dir)
+        states = _open_columns(out_dir, N, 'r+')
+        locked = np.lib.format.open_memmap(locked_path, mode='r+')
+    else:
+        states = _open_columns(out_dir, N, 'w+')
+        locked = np.lib.format.open_memmap(locked_path, mode='w+', dtype=bool,
+                                           shape=(N,))
+        done = np.lib.format.open_memmap(done_path, mode='w+', dtype=bool,
+                                         shape=(n_chunks,))
+        # the configurations are written last, they mark a valid output
+        # directory
+        np.save(config_path, configurations)
+
+    def merge(chunk):
+        # copy a checkpoint into the columns and remove it afterwards
+        path = _chunk_path(out_dir, chunk)
+        chunk_states = np.load(path)
+        rows = slice(chunk*chunksize, chunk*chunksize + len(chunk_states))
+        for column, values in zip(states, chunk_states[:, :-1].T):
+            column[rows] = values
+            column.flush()
+        locked[rows] = chunk_states[:, -1] > 0
+        locked.flush()
+        done[chunk] = True
+        done.flush()
+        os.remove(path)
+
+    # checkpoints which were written but not merged before an interruption
+    for chunk in np.flatnonzero(~done):
+        if os.path.exists(_chunk_path(out_dir, chunk)):
+            merge(chunk)
+
+    pending = np.flatnonzero(~done)
+    if len(pending) > 0:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(_simulate_chunk, out_dir, chunk,
+                            configurations[chunk*chunksize:(chunk+1)*chunksize],
+                            uvt, engine, early_abort)
+                       for chunk in pending]
+            for num, future in enumerate(
+                    concurrent.futures.as_completed(futures)):
+                merge(future.result())
+                print('%s/%s chunks' % (num + 1 + n_chunks - len(pending),
+                                        n_chunks))
+
+    return np.column_stack(states)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configurations', type=str,
+                        help='.npy file with rows (a1, a2, a3, ap, K)')
+    parser.add_argument('out_dir', type=str, help='output directory')
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--max_workers', type=int, default=None)
+    parser.add_argument('--engine', type=str, default='dop853')
+    parser.add_argument('--early_abort', action='store_true')
+    args = parser.parse_args()
+
+    generate_dataset(np.load(args.configurations), args.out_dir,
+                     chunksize=args.chunksize, max_workers=args.max_workers,
+                     engine=args.engine, early_abort=args.early_abort)
@@ -1,19 +1,11 @@
 import numpy as np
-import xlrd
+from dataset_cache import load_array
 import theano
 
 def load_data(filename):
 
-    # load data post preprocess1
-    simulation_results = xlrd.open_workbook(filename)
-    worksheet = simulation_results.sheet_by_index(0)
-    
-    batchdata = np.asarray(worksheet.col_values(0)).reshape((-1,1))
-    
-    num_col = worksheet.row_len(0)
-    for i in range(1,num_col):
-        batchdata = np.concatenate((batchdata, 
-                                    np.asarray(worksheet.col_values(i)).reshape((-1,1))), axis=1)
+    # load data post preprocess1 (binary cache of the workbook)
+    batchdata = load_array(filename)
     
     data_max =  batchdata.max(axis=0)
     data_min =  batchdata.min(axis=0)
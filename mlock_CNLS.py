@@ -5,158 +5,833 @@ Created on Sat Apr 29 12:33:32 2017
 """
 
 # numerical packages
+import os
+import functools
+from collections import namedtuple
 import numpy as np
 from numpy.testing import assert_equal
 from scipy.integrate import complex_ode
+import scipy.fft
 #from scipy.stats import kurtosis
 from scipy.stats import moment
 
 # time measurement
 import time
 
+# optional FFTW backend of the propagation (see set_fft_backend)
+try:
+    import pyfftw.interfaces.numpy_fft
+    pyfftw.interfaces.cache.enable()
+except ImportError:
+    pyfftw = None
+
+# jones matrices of the waveplates & polarizer
+from polarization_optics import transfer_functions, apply_transfer
+
 """Definition of the model parameter"""
 
-def laser_simulation(uvt, alpha1, alpha2, alpha3, alphap,K):
-    # parameters of the Maxwell equation
+# parameters of the Maxwell equation
+"""
+D = 1
+K = 0.1
+E0 = 1
+tau = 0.1
+g0 = 0.3
+Gamma = 0.2
+"""
+D = -0.4
+E0 = 4.23
+tau = 0.1
+g0 = 1.73
+Gamma = 0.1
+
+Z = 1.5         # cavity length
+T = 60
+n = 256       # t slices
+Rnd = 500     # round trips
+
+# number of fixed steps per round trip of the split-step engine
+ssfm_steps = 100
+# precision of the split-step engines: 'ssfm32' works on complex64 fields
+ssfm_dtypes = {'ssfm': np.complex128, 'ssfm32': np.complex64}
+# FFT implementation of the propagation, see set_fft_backend
+fft_backend = {'name': 'numpy', 'workers': 1}
+
+def transfer_function(alpha1, alpha2, alpha3, alphap):
+    """ Jones matrix of the quarter waveplates, the half waveplate and the 
+    polarizer for one set of orientations (applied once per round trip), 
+    see polarization_optics.transfer_functions for arrays of orientations
     """
-    D = 1
-    K = 0.1
-    E0 = 1
-    tau = 0.1
-    g0 = 0.3
-    Gamma = 0.2
-    """
-    D = -0.4
-    E0 = 4.23
-    tau = 0.1
-    g0 = 1.73
-    Gamma = 0.1
-    
-    Z = 1.5         # cavity length
-    T = 60
-    n = 256       # t slices
-    Rnd = 500     # round trips
+    return transfer_functions(alpha1, alpha2, alpha3, alphap)
+
+
+def set_fft_backend(backend='numpy', workers=None):
+    """ Selects the FFT implementation of the propagation (rhs of the ode, 
+    split-step engines and the transfer step of laser_simulation_batch)
+    
+    The transforms act on the last axis of arrays [N, 2, n]: a multi-threaded
+    backend distributes the 2*N transforms of a batch over its threads. The 
+    short transforms of a single cavity gain nothing from threads.
+    
+    Parameters
+    --------------------------------------------------------------------------
+    backend:    string
+                'numpy' (np.fft, single-threaded, default), 'scipy' (scipy.fft)
+                or 'pyfftw' (FFTW, requires pyFFTW)
+    workers:    int
+                number of threads of 'scipy' and 'pyfftw' (default: all cores
+                of the node)
+    """
+    if backend not in ('numpy', 'scipy', 'pyfftw'):
+        raise ValueError('unknown fft backend: %s' % backend)
+    if backend == 'pyfftw' and pyfftw is None:
+        raise ImportError('the fft backend pyfftw requires pyFFTW')
+    if workers is None:
+        workers = 1 if backend == 'numpy' else os.cpu_count()
+    fft_backend['name'] = backend
+    fft_backend['workers'] = workers
+
+
+def fft_functions(dtype=np.complex128):
+    """ (fft, ifft) over the last axis with the selected backend (see 
+    set_fft_backend) for fields of precision dtype. np.fft always computes 
+    in double precision, complex64 fields of the 'numpy' backend are 
+    transformed with scipy.fft.
+    """
+    name, workers = fft_backend['name'], fft_backend['workers']
+    if name == 'pyfftw':
+        return (functools.partial(pyfftw.interfaces.numpy_fft.fft, axis=-1,
+                                  threads=workers),
+                functools.partial(pyfftw.interfaces.numpy_fft.ifft, axis=-1,
+                                  threads=workers))
+    if name == 'scipy' or np.dtype(dtype) == np.complex64:
+        return (functools.partial(scipy.fft.fft, axis=-1, workers=workers),
+                functools.partial(scipy.fft.ifft, axis=-1, workers=workers))
+    return (functools.partial(np.fft.fft, axis=-1),
+            functools.partial(np.fft.ifft, axis=-1))
+
+
+def time_frequency_grid(n=None, T=None):
+    """ time discretization t_dis and wavenumbers k of the periodic domain
+    [-T/2, T/2) with n slices (default: module parameters n and T)
+    """
+    n = globals()['n'] if n is None else n
+    T = globals()['T'] if T is None else T
     t2 = np.linspace(-T/2,T/2,n+1)
-    t_dis = t2[0:n].reshape([1,n])   # time discretization
+    t_dis = t2[0:n]   # time discretization
     new = np.concatenate((np.linspace(0,n//2-1,n//2),
                           np.linspace(-n//2,-1,n//2)),0)
     k = (2*np.pi/T)*new
+    
+    return t_dis, k
+
+
+def reference_rhs(ts, uvt, K):
+    """ rhs of the coupled nonlinear schroedinger equations (fourier space) 
+    written out term by term - reference for CNLSRightHandSide
+    """
+    t_dis, k = time_frequency_grid()
+    [ut_rhs,vt_rhs] = np.split(uvt,2)
+    u = np.fft.ifft(ut_rhs)
+    v = np.fft.ifft(vt_rhs)
+    # calculation of the energy function
+    E = np.trapz(np.conj(u)*u+np.conj(v)*v,t_dis)
+    
+    # u of the rhs
+    urhs = -1j*0.5*D*(k**2)*ut_rhs - 1j*K*ut_rhs + \
+            1j*np.fft.fft((np.conj(u)*u+ (2/3)*np.conj(v)*v)*u + \
+                          (1/3)*(v**2)*np.conj(u)) + \
+            2*g0/(1+E/E0)*(1-tau*(k**2))*ut_rhs - Gamma*ut_rhs
+    
+    # v of the rhs
+    vrhs = -1j*0.5*D*(k**2)*vt_rhs + 1j*K*vt_rhs + \
+            1j*np.fft.fft((np.conj(v)*v+(2/3)*np.conj(u)*u)*v + \
+                          (1/3)*(u**2)*np.conj(v) ) + \
+            2*g0/(1+E/E0)*(1-tau*(k**2))*vt_rhs - Gamma*vt_rhs
+     
+    return np.concatenate((urhs, vrhs),axis=0)
+
+
+class CNLSRightHandSide(object):
+    """ rhs of the coupled nonlinear schroedinger equations on a fixed grid
+    
+    The spectral operators (dispersion, loss, gain filter) and the weights of
+    the trapezoidal energy integral are built once per (n, T) grid. All
+    intermediate results are written into preallocated work buffers; only 
+    the two FFTs per evaluation allocate their outputs (numpy keeps the FFT
+    plans of a length in its own cache). The FFTs use the backend selected 
+    by set_fft_backend at the time of the evaluation. The returned array is a buffer 
+    which is overwritten by the next evaluation - complex_ode copies it.
+    
+    Works on fields of shape [2*n,] (one cavity) and [N*2*n,] (N cavities,
+    see laser_simulation_batch).
+    """
+    _instances = {}
+    
+    @classmethod
+    def for_grid(cls, n=None, T=None):
+        """ shared instance for the (n, T) grid """
+        n = globals()['n'] if n is None else n
+        T = globals()['T'] if T is None else T
+        if (n, T) not in cls._instances:
+            cls._instances[(n, T)] = cls(n, T)
+        return cls._instances[(n, T)]
+    
+    def __init__(self, n=None, T=None):
+        t_dis, k = time_frequency_grid(n, T)
+        self.n = len(t_dis)
+        # linear operator (dispersion and loss) and gain filter
+        self.linear = -1j*0.5*D*(k**2) - Gamma
+        self.gain_filter = 2*g0*(1-tau*(k**2))
+        # weights of the trapezoidal rule
+        self.weights = np.full(self.n, t_dis[1]-t_dis[0])
+        self.weights[[0, -1]] /= 2
+        self.batch = None
+        self.set_birefringence(0.0)
+    
+    def set_birefringence(self, K):
+        """ K: float, or array with one value per cavity """
+        self.K = np.reshape(np.array([-1j, 1j]), [1, 2, 1]) * \
+                 np.reshape(K, [-1, 1, 1])
+    
+    def _allocate(self, batch):
+        # work buffers for a batch of cavities
+        shape = (batch, 2, self.n)
+        self.batch = batch
+        self.I = np.empty(shape)
+        self.tmp_real = np.empty((batch, self.n))
+        self.tmp = np.empty((batch, self.n), dtype=complex)
+        self.nonlin = np.empty(shape, dtype=complex)
+        self.coef = np.empty(shape, dtype=complex)
+        self.out = np.empty(shape, dtype=complex)
+    
+    def __call__(self, ts, uvt):
+        uvt = uvt.reshape(-1, 2, self.n)
+        if uvt.shape[0] != self.batch:
+            self._allocate(uvt.shape[0])
+        I, tmp_real, tmp = self.I, self.tmp_real, self.tmp
+        nonlin, coef, out = self.nonlin, self.coef, self.out
+        fft, ifft = fft_functions()
+        
+        uv = ifft(uvt)
+        u = uv[:, 0, :]
+        v = uv[:, 1, :]
+        np.square(uv.real, out=I)
+        np.square(uv.imag, out=coef.real)
+        I += coef.real
+        
+        # calculation of the energy function for each cavity
+        np.add(I[:, 0, :], I[:, 1, :], out=tmp_real)
+        E = np.dot(tmp_real, self.weights).reshape(-1, 1, 1)
+        
+        # (|u|^2 + 2/3|v|^2)u + 1/3 v^2 conj(u)
+        np.multiply(I[:, 1, :], 2/3, out=tmp_real)
+        tmp_real += I[:, 0, :]
+        np.multiply(tmp_real, u, out=nonlin[:, 0, :])
+        np.conjugate(u, out=tmp)
+        tmp *= v
+        tmp *= v
+        tmp *= 1/3
+        nonlin[:, 0, :] += tmp
+        
+        # (|v|^2 + 2/3|u|^2)v + 1/3 u^2 conj(v)
+        np.multiply(I[:, 0, :], 2/3, out=tmp_real)
+        tmp_real += I[:, 1, :]
+        np.multiply(tmp_real, v, out=nonlin[:, 1, :])
+        np.conjugate(v, out=tmp)
+        tmp *= u
+        tmp *= u
+        tmp *= 1/3
+        nonlin[:, 1, :] += tmp
+        
+        # linear part with saturable gain
+        np.multiply(self.gain_filter, 1/(1+E/E0), out=coef)
+        coef += self.linear
+        coef += self.K
+        np.multiply(coef, uvt, out=out)
+        
+        # nonlinear part
+        nonlin = fft(nonlin)
+        nonlin *= 1j
+        out += nonlin
+        
+        return out.reshape(-1)
+
+
+def benchmark_rhs(evaluations=2000, batch=1):
+    """ rhs evaluations per second of reference_rhs (one cavity) and of 
+    CNLSRightHandSide (batch of cavities, counted per cavity)
+    """
+    uvt = sech_field()
+    K = 0.1
+    
+    start = time.time()
+    for i in range(evaluations):
+        reference_rhs(0, uvt, K)
+    reference = evaluations/(time.time()-start)
+    
+    rhs = CNLSRightHandSide.for_grid()
+    rhs.set_birefringence(np.full(batch, K))
+    uvt_batch = np.tile(uvt, batch)
+    start = time.time()
+    for i in range(evaluations):
+        rhs(0, uvt_batch)
+    operator = evaluations*batch/(time.time()-start)
+    
+    return reference, operator
+
+
+def split_step_propagator(K, steps=None, n=None, T=None, dtype=np.complex128):
+    """ Fixed-step symmetric split-step Fourier propagator over one cavity 
+    length Z
+    
+    The linear part (dispersion D, birefringence K and loss Gamma) is applied 
+    in fourier space with the precomputed propagators exp(L*dz/2) and 
+    exp(L*dz). The saturable gain 2*g0/(1+E/E0)*(1-tau*k**2) only depends on 
+    the energy E which is evaluated at the midpoint of each linear step. The 
+    nonlinear part conserves |u|**2 + |v|**2 and is solved exactly in the 
+    circular polarization basis a = (u+iv)/sqrt(2), b = (u-iv)/sqrt(2), where 
+    it reduces to the phase rotations 
+    a*exp(i*2/3*(|a|**2+2|b|**2)*dz) and b*exp(i*2/3*(|b|**2+2|a|**2)*dz).
+    
+    Parameters
+    --------------------------------------------------------------------------
+    K:          float or array, shape=[N,]
+                birefringence of the configuration(s) to propagate
+    steps:      int
+                number of fixed steps per round trip (default: ssfm_steps)
+    n, T:       int, float
+                time grid (default: module parameters n and T)
+    dtype:      numpy dtype
+                np.complex128 or np.complex64 - precision of the fields, the 
+                operators and the FFTs (backend of set_fft_backend at the 
+                time of the call, see fft_functions)
+
+    Returns
+    --------------------------------------------------------------------------
+    round_trip: function
+                maps fields (fourier space) of shape [2, n] for a scalar K or 
+                [N, 2, n] for an array of K values onto the fields after one 
+                round trip
+    """
+    if steps is None:
+        steps = ssfm_steps
+    t_dis, k = time_frequency_grid(n, T)
+    dz = Z/steps
+    
+    fft, ifft = fft_functions(dtype)
+    real = np.finfo(dtype).dtype
+    t_dis = t_dis.astype(real)
+    
+    if np.ndim(K) == 0:
+        K_sign = np.array([-1j, 1j]).reshape(2, 1)*K
+    else:
+        K_sign = np.array([-1j, 1j]).reshape(1, 2, 1) * \
+                 np.reshape(K, [-1, 1, 1])
+    
+    # linear operator without the gain and the corresponding propagators
+    L = -1j*0.5*D*(k**2) + K_sign - Gamma
+    exp_L = {dz/2: np.exp(L*dz/2).astype(dtype), 
+             dz: np.exp(L*dz).astype(dtype)}
+    # spectral gain filter
+    gain_filter = (1-tau*(k**2)).astype(real)
+    
+    def energy(uv):
+        # energy of the fields in the time domain (trapezoidal rule as in the
+        # rhs of the ode)
+        I = np.sum(np.abs(uv)**2, axis=-2)
+        return np.trapz(I, t_dis, axis=-1)[..., np.newaxis, np.newaxis]
+    
+    def linear_step(uvt, h, E):
+        # the spectral weights of the gain filter give the rate of change of
+        # the energy (parseval, rescaled to the trapezoidal energy E)
+        I = np.abs(uvt)**2
+        E_filter = E*np.sum(gain_filter*I, axis=(-2, -1), keepdims=True)/ \
+                   np.sum(I, axis=(-2, -1), keepdims=True)
+        G = 2*g0/(1+E/E0)
+        # saturable gain evaluated at the energy of the midpoint of the step
+        E_mid = E + h*(G*E_filter - Gamma*E)
+        G_mid = 2*g0/(1+E_mid/E0)
+        return exp_L[h]*np.exp(G_mid*h*gain_filter)*uvt
+    
+    def nonlinear_step(uv):
+        a = (uv[..., 0, :] + 1j*uv[..., 1, :])/np.sqrt(2)
+        b = (uv[..., 0, :] - 1j*uv[..., 1, :])/np.sqrt(2)
+        I_a = np.abs(a)**2
+        I_b = np.abs(b)**2
+        a = a*np.exp(1j*(2/3)*(I_a + 2*I_b)*dz)
+        b = b*np.exp(1j*(2/3)*(I_b + 2*I_a)*dz)
+        return np.stack(((a + b)/np.sqrt(2), (a - b)/(1j*np.sqrt(2))), axis=-2)
+    
+    def round_trip(uvt):
+        # neighbouring half steps of the linear part are merged. The energy 
+        # is not changed by the nonlinear step, so it is taken from the time
+        # domain fields of the nonlinear step.
+        uvt = np.asarray(uvt, dtype=dtype)
+        uvt = linear_step(uvt, dz/2, energy(ifft(uvt)))
+        for step in range(steps):
+            uv = ifft(uvt)
+            E = energy(uv)
+            uvt = fft(nonlinear_step(uv))
+            uvt = linear_step(uvt, dz if step < steps - 1 else dz/2, E)
+        return uvt
+    
+    return round_trip
+
+
+class RelativeNorm(object):
+    """ stop criterion: relative change of the pulse profile 
+    ||phi_j - phi_(j-1)|| / ||phi_(j-1)|| <= tol
+    """
+    locked = True
+    
+    def __init__(self, tol=1e-6):
+        self.tol = tol
+    
+    def __call__(self, monitor):
+        return monitor.change_norm <= self.tol
+
+
+class EnergyPlateau(object):
+    """ stop criterion: relative change of the energy below tol for window
+    consecutive round trips
+    """
+    locked = True
+    
+    def __init__(self, tol=1e-8, window=10):
+        self.tol = tol
+        self.window = window
+    
+    def __call__(self, monitor):
+        if monitor.energy_change <= self.tol:
+            monitor.plateau += 1
+        else:
+            monitor.plateau = 0
+        return monitor.plateau >= self.window
+
+
+class WallClock(object):
+    """ stop criterion: wall time budget of a simulation in seconds """
+    locked = False
+    
+    def __init__(self, budget):
+        self.budget = budget
+    
+    def __call__(self, monitor):
+        return time.time() - monitor.start >= self.budget
+
+
+class Divergence(object):
+    """ abort criterion: non-finite fields or an energy above max_energy """
+    locked = False
+    
+    def __init__(self, max_energy=1e4):
+        self.max_energy = max_energy
+    
+    def __call__(self, monitor):
+        return not (np.isfinite(monitor.energy) and 
+                    np.isfinite(monitor.change_norm) and 
+                    monitor.energy <= self.max_energy)
+
+
+class EnergyCollapse(object):
+    """ abort criterion: energy below fraction of the energy after the first 
+    round trip - the gain does not compensate the losses
+    """
+    locked = False
+    
+    def __init__(self, fraction=1e-3):
+        self.fraction = fraction
+    
+    def reset(self):
+        self.initial = None
+    
+    def __call__(self, monitor):
+        if self.initial is None:
+            self.initial = monitor.energy
+        return monitor.energy < self.fraction*self.initial
+
+
+class _Window(object):
+    # ring buffer of log(change_norm) and the energy of the last round trips
+    def __init__(self, window):
+        self.window = window
+    
+    def reset(self):
+        self.log_change = np.zeros(self.window)
+        self.energy = np.zeros(self.window)
+        self.count = 0
+    
+    def push(self, monitor):
+        # the first round trip has no change_norm yet
+        if monitor.round_trips < 2:
+            return False
+        index = self.count % self.window
+        self.log_change[index] = np.log(max(monitor.change_norm, 1e-300))
+        self.energy[index] = monitor.energy
+        self.count += 1
+        return self.count >= self.window
+    
+    def trend(self):
+        # slope of log(change_norm) per round trip (least squares)
+        order = np.arange(self.count - self.window, self.count) % self.window
+        return np.polyfit(np.arange(self.window), self.log_change[order], 1)[0]
+
+
+class Oscillation(_Window):
+    """ abort criterion: the change of the pulse profile does not decrease 
+    over `window` round trips while the energy stays within energy_tol 
+    (relative) - a drifting or breathing pulse which never becomes stationary
+    """
+    locked = False
+    
+    def __init__(self, window=100, energy_tol=1e-2):
+        _Window.__init__(self, window)
+        self.energy_tol = energy_tol
+    
+    def __call__(self, monitor):
+        if not self.push(monitor):
+            return False
+        energy_range = np.ptp(self.energy)/np.mean(self.energy)
+        return self.trend() >= 0 and energy_range < self.energy_tol
+
+
+class ConvergenceForecast(_Window):
+    """ abort criterion: extrapolating the decay of change_norm over the last 
+    `window` round trips, tol is not reached within margin*max_round_trips
+    round trips (checked from round trip `start` on)
+    """
+    locked = False
+    
+    def __init__(self, tol=1e-6, window=50, start=200, margin=2.0, 
+                 max_round_trips=None):
+        _Window.__init__(self, window)
+        self.tol = tol
+        self.start = start
+        self.margin = margin
+        self.max_round_trips = max_round_trips
+    
+    def __call__(self, monitor):
+        if not self.push(monitor) or monitor.round_trips < self.start:
+            return False
+        rate = -self.trend()
+        if rate <= 0:
+            return True
+        needed = np.log(monitor.change_norm/self.tol)/rate
+        budget = Rnd if self.max_round_trips is None else self.max_round_trips
+        return monitor.round_trips + needed > self.margin*budget
+
+
+def abort_criteria():
+    """ default criteria which abort configurations that do not mode-lock, 
+    e.g. ConvergenceMonitor(criteria=[RelativeNorm()] + abort_criteria())
+    """
+    return [Divergence(), EnergyCollapse(), Oscillation(), 
+            ConvergenceForecast()]
+
+
+class ConvergenceMonitor(object):
+    """ Streaming convergence check of the round trips
+    
+    Only the pulse profile phi of the previous round trip is kept. The round 
+    trips stop as soon as one of the criteria is met. Optionally the energy, 
+    change_norm (and the profiles phi) of the last `history` round trips are 
+    recorded in a preallocated ring buffer.
+    
+    Criteria with locked = False (Divergence, EnergyCollapse, Oscillation, 
+    ConvergenceForecast, WallClock) abort the simulation; `locked` tells 
+    whether the configuration mode-locked, i.e. whether the round trips were 
+    stopped by a convergence criterion (RelativeNorm, EnergyPlateau).
+    """
+    def __init__(self, criteria=None, history=0, record_profiles=False):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        criteria:   list
+                    stop criteria (RelativeNorm, EnergyPlateau, WallClock, 
+                    the abort criteria or any function of the monitor 
+                    returning a bool), default: [RelativeNorm(1e-6)]
+        history:    int
+                    length of the ring buffer of the diagnostics, 0 disables
+                    the recording
+        record_profiles:
+                    bool
+                    also record the pulse profile phi of every round trip
+        """
+        self.criteria = [RelativeNorm()] if criteria is None else criteria
+        self.history = history
+        self.record_profiles = record_profiles
+    
+    def reset(self):
+        """ prepares the monitor for a new simulation """
+        self.start = time.time()
+        self.round_trips = 0
+        self.phi = None
+        self.change_norm = 100
+        self.energy = None
+        self.energy_change = np.inf
+        self.plateau = 0
+        self.stopped_by = None
+        for criterion in self.criteria:
+            if hasattr(criterion, 'reset'):
+                criterion.reset()
+        if self.history > 0:
+            self.energy_buffer = np.zeros(self.history)
+            self.change_norm_buffer = np.zeros(self.history)
+            self.profile_buffer = None
+    
+    def update(self, phi, energy):
+        """ registers the pulse profile phi and the energy of a round trip
+        and returns True if the round trips shall stop
+        """
+        if self.phi is not None:
+            self.change_norm = np.linalg.norm(phi - self.phi)/ \
+                               np.linalg.norm(self.phi)
+        if self.energy is not None:
+            self.energy_change = abs(energy - self.energy)/abs(self.energy)
+        self.phi = phi
+        self.energy = energy
+        
+        if self.history > 0:
+            index = self.round_trips % self.history
+            self.energy_buffer[index] = energy
+            self.change_norm_buffer[index] = self.change_norm
+            if self.record_profiles:
+                if self.profile_buffer is None:
+                    self.profile_buffer = np.zeros([self.history, len(phi)])
+                self.profile_buffer[index] = phi
+        self.round_trips += 1
+        
+        for criterion in self.criteria:
+            if criterion(self):
+                self.stopped_by = criterion
+                return True
+        return False
+    
+    @property
+    def locked(self):
+        """ whether the last simulation was stopped by a convergence 
+        criterion (False if it was aborted or ran out of round trips)
+        """
+        return self.stopped_by is not None and \
+               getattr(self.stopped_by, 'locked', True)
+    
+    def diagnostics(self):
+        """ recorded diagnostics of the last round trips in chronological 
+        order: dict with 'energy', 'change_norm' (and 'phi')
+        """
+        if self.history == 0:
+            return {}
+        count = min(self.round_trips, self.history)
+        order = np.arange(self.round_trips - count, self.round_trips) % \
+                self.history
+        diagnostics = {'energy': self.energy_buffer[order],
+                       'change_norm': self.change_norm_buffer[order]}
+        if self.record_profiles and self.profile_buffer is not None:
+            diagnostics['phi'] = self.profile_buffer[order]
+        return diagnostics
+
+
+class RoundTripMap(object):
+    """ One round trip of the cavity as a map of the fields: propagation 
+    over Z followed by the transfer function of the waveplates & polarizer
+    """
+    def __init__(self, alpha1, alpha2, alpha3, alphap, K, engine='dop853',
+                 n=None, T=None):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        alpha1, alpha2, alpha3, alphap, K:
+                    float
+                    orientation of the wave plates, the polarizer and the 
+                    birefringence
+        engine:     string
+                    'dop853', 'ssfm' or 'ssfm32', see laser_simulation
+        n, T:       int, float
+                    time grid (default: module parameters n and T)
+        """
+        self.t_dis, _ = time_frequency_grid(n, T)
+        self.n = len(self.t_dis)
+        self.T = T
+        if engine in ssfm_dtypes:
+            self.propagate = split_step_propagator(K, n=self.n, T=T, 
+                                                   dtype=ssfm_dtypes[engine])
+        elif engine != 'dop853':
+            raise ValueError('unknown engine: %s' % engine)
+        self.engine = engine
+        self.K = K
+        self.Transf = transfer_function(alpha1, alpha2, alpha3, alphap)
+        self.evaluations = 0
+    
+    def __call__(self, uvt):
+        """ fields (fourier space, shape=[2*n,]) after one round trip, the 
+        pulse profile phi after the polarizer and the energy before it
+        """
+        n = self.n
+        if self.engine in ssfm_dtypes:
+            sol = self.propagate(uvt.reshape(2, n)).reshape(2*n,)
+        else:
+            rhs = CNLSRightHandSide.for_grid(n, self.T)
+            rhs.set_birefringence(self.K)
+            uvtsol = complex_ode(rhs)
+            uvtsol.set_integrator('dop853')
+            uvtsol.set_initial_value(uvt, 0.0)
+            sol = uvtsol.integrate(Z)
+        
+        uv = np.fft.ifft(sol.reshape(2, n), axis=-1)
+        energy = np.trapz(np.abs(uv[0])**2 + np.abs(uv[1])**2, self.t_dis)
+        uvplus = apply_transfer(self.Transf, uv)
+        phi = np.sqrt(np.abs(uvplus[0])**2 + np.abs(uvplus[1])**2)
+        self.evaluations += 1
+        
+        return np.fft.fft(uvplus, axis=-1).reshape(2*n,), phi, energy
+
+
+def pulse_states(phi, alpha1, alpha2, alpha3, alphap, T=None):
+    """ [E, M4, alpha1, alpha2, alpha3, alphap] of a pulse profile phi """
+    t_dis, _ = time_frequency_grid(len(phi), T)
+    kur = np.abs(np.fft.fftshift(np.fft.fft(phi)))
+    M4 = moment(kur,4)/np.std(kur)**4
+    E = np.sqrt(np.trapz(phi**2, t_dis))
+    
+    return np.array([E, M4, alpha1, alpha2, alpha3, alphap])
+
+
+# compact record of one round trip, see round_trips
+RoundTripRecord = namedtuple('RoundTripRecord', 
+                             ['round_trip', 'energy', 'change_norm', 'uvt'])
+
+
+def round_trips(uvt, alpha1, alpha2, alpha3, alphap, K, engine='dop853',
+                monitor=None, T=None, fields=False):
+    """ Round trips of laser_simulation as a stream of records
+    
+    A generator which yields one record per round trip and ends when the 
+    monitor stops the round trips or after Rnd round trips. Nothing is 
+    accumulated, so a consumer can stop early, write the records to disk or 
+    plot them while the simulation runs; round_trip_history collects them 
+    into arrays. The states after the last round trip are 
+    pulse_states(monitor.phi, alpha1, alpha2, alpha3, alphap, T).
+    
+    Parameters
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,]
+                initial fields (fourier space)
+    alpha1, alpha2, alpha3, alphap, K:
+                float
+                orientation of the wave plates, the polarizer and the 
+                birefringence
+    engine:     string
+                'dop853', 'ssfm' or 'ssfm32', see laser_simulation
+    monitor:    ConvergenceMonitor
+                decides when the round trips stop (default: relative change 
+                of the pulse profile below 1e-6), reset before the first 
+                round trip
+    T:          float
+                length of the time window (default: module parameter T), the 
+                number of time slices n is given by the length of uvt
+    fields:     bool
+                include the fields after each round trip in the records
+
+    Yields
+    --------------------------------------------------------------------------
+    record:     RoundTripRecord
+                (round_trip, energy, change_norm, uvt): index of the round 
+                trip, energy before the polarizer, relative change of the 
+                pulse profile (100 for the first round trip) and the fields 
+                (fourier space, shape=[2*n,]) after the round trip or None
+    """
+    n = len(uvt)//2
+    t_dis, _ = time_frequency_grid(n, T)
     ts=[]
     ys=[]
     t0=0.0
     tend=1
     
-    # waveplates & polarizer
-    W4 = np.array([[np.exp(-1j*np.pi/4), 0],[0, np.exp(1j*np.pi/4)]]); # quarter waveplate
-    W2 = np.array([[-1j, 0],[0, 1j]]);  # half waveplate
-    WP = np.array([[1, 0], [0, 0]]);  # polarizer
-    
-    # waveplate settings
-    R1 = np.array([[np.cos(alpha1), -np.sin(alpha1)], 
-                   [np.sin(alpha1), np.cos(alpha1)]])
-    R2 = np.array([[np.cos(alpha2), -np.sin(alpha2)], 
-                   [np.sin(alpha2), np.cos(alpha2)]])
-    R3 = np.array([[np.cos(alpha3), -np.sin(alpha3)], 
-                   [np.sin(alpha3), np.cos(alpha3)]])
-    RP = np.array([[np.cos(alphap), -np.sin(alphap)], 
-                   [np.sin(alphap), np.cos(alphap)]])
-    J1 = np.matmul(np.matmul(R1,W4),np.transpose(R1))
-    J2 = np.matmul(np.matmul(R2,W4),np.transpose(R2))
-    J3 = np.matmul(np.matmul(R3,W2),np.transpose(R3))
-    JP = np.matmul(np.matmul(RP,WP),np.transpose(RP))
-    
-    # transfer function
-    Transf = np.matmul(np.matmul(np.matmul(J1,JP),J2),J3)
-    
-    urnd=np.zeros([Rnd, n], dtype=complex)
-    vrnd=np.zeros([Rnd, n], dtype=complex)
-    t_dis=t_dis.reshape(n,)
-    energy=np.zeros([1,Rnd])
-    
-    # definition of the rhs of the ode
-    def mlock_CNLS_rhs(ts, uvt):
-        [ut_rhs,vt_rhs] = np.split(uvt,2)
-        u = np.fft.ifft(ut_rhs)
-        v = np.fft.ifft(vt_rhs)
-        # calculation of the energy function
-        E = np.trapz(np.conj(u)*u+np.conj(v)*v,t_dis)
-        
-        # u of the rhs
-        urhs = -1j*0.5*D*(k**2)*ut_rhs - 1j*K*ut_rhs + \
-                1j*np.fft.fft((np.conj(u)*u+ (2/3)*np.conj(v)*v)*u + \
-                              (1/3)*(v**2)*np.conj(u)) + \
-                2*g0/(1+E/E0)*(1-tau*(k**2))*ut_rhs - Gamma*ut_rhs
-        
-        # v of the rhs
-        vrhs = -1j*0.5*D*(k**2)*vt_rhs + 1j*K*vt_rhs + \
-                1j*np.fft.fft((np.conj(v)*v+(2/3)*np.conj(u)*u)*v + \
-                              (1/3)*(u**2)*np.conj(v) ) + \
-                2*g0/(1+E/E0)*(1-tau*(k**2))*vt_rhs - Gamma*vt_rhs
-         
-        return np.concatenate((urhs, vrhs),axis=0)
+    # transfer function of the waveplates & polarizer
+    Transf = transfer_function(alpha1, alpha2, alpha3, alphap)
+    
+    # engine which propagates the fields over one round trip
+    if engine in ssfm_dtypes:
+        propagate = split_step_propagator(K, n=n, T=T, 
+                                          dtype=ssfm_dtypes[engine])
+    elif engine != 'dop853':
+        raise ValueError('unknown engine: %s' % engine)
+    
+    if monitor is None:
+        monitor = ConvergenceMonitor()
+    monitor.reset()
+    
+    
+    # rhs of the ode, the operators of the grid are built only once
+    mlock_CNLS_rhs = CNLSRightHandSide.for_grid(n, T)
     
     # definition of the solution output for the ode integration
     def solout(t,y):
         ts.append(t)
         ys.append(y.copy())
         
-    start = time.time()
-    
-    uv_list = []
-    norms = []
-    change_norm = 100
+    converged = False
     jrnd = 0
     # solving the ode for Rnd rounds
-    while(jrnd < Rnd and change_norm > 1e-6):
+    while(jrnd < Rnd and not converged):
         ts = []
         ys = []
         
         t0 = Z*jrnd
         tend = Z*(jrnd+1)
         
-        uvtsol = complex_ode(mlock_CNLS_rhs)
-        uvtsol.set_integrator(method='adams', name='dop853') # alternative 'dopri5'
-        uvtsol.set_solout(solout)
-        uvtsol.set_initial_value(uvt, t0)
-        sol = uvtsol.integrate(tend)
-        assert_equal(ts[0], t0)
-        assert_equal(ts[-1], tend)
+        if engine in ssfm_dtypes:
+            sol = propagate(uvt.reshape(2, n)).reshape(2*n,)
+        else:
+            # the rhs is shared by all simulations on the grid, another one
+            # may have run since the last round trip of this generator
+            mlock_CNLS_rhs.set_birefringence(K)
+            uvtsol = complex_ode(mlock_CNLS_rhs)
+            uvtsol.set_integrator(method='adams', name='dop853') # alternative 'dopri5'
+            uvtsol.set_solout(solout)
+            uvtsol.set_initial_value(uvt, t0)
+            sol = uvtsol.integrate(tend)
+            assert_equal(ts[0], t0)
+            assert_equal(ts[-1], tend)
         
-        u=np.fft.ifft(sol[0:n])
-        v=np.fft.ifft(sol[n:2*n])
+        uv=np.fft.ifft(sol.reshape(2,n), axis=-1)
         
-        urnd[jrnd,:]=u
-        vrnd[jrnd,:]=v
-        energy[0, jrnd]=np.trapz(np.abs(u)**2+np.abs(v)**2,t_dis)
+        energy=np.trapz(np.abs(uv[0])**2+np.abs(uv[1])**2,t_dis)
         
-        uvplus=np.matmul(Transf,np.transpose(np.concatenate((u.reshape(n,1),
-                                                              v.reshape(n,1)),axis=1)))
-        uv_list.append(np.concatenate((uvplus[0,:],
-                                       uvplus[1,:]), axis=0))
+        uvplus=apply_transfer(Transf, uv)
         
-        uvt=np.concatenate((np.fft.fft(uvplus[0,:]),
-                                       np.fft.fft(uvplus[1,:])), axis=0)
+        uvt=np.fft.fft(uvplus, axis=-1).reshape(2*n,)
         
-        if jrnd > 0:
-            phi=np.sqrt(np.abs(np.vstack(uv_list)[:,:n])**2 + \
-                        np.abs(np.vstack(uv_list)[:,n:2*n])**2)
-            change_norm=np.linalg.norm((phi[-1,:]-phi[len(phi)-2,:]))/ \
-            np.linalg.norm(phi[len(phi)-2,:])
-            norms.append(change_norm) 
+        # pulse profile after the round trip - only the previous one is kept
+        # by the monitor
+        phi=np.sqrt(np.abs(uvplus[0,:])**2 + np.abs(uvplus[1,:])**2)
+        converged = monitor.update(phi, energy)
+        
+        yield RoundTripRecord(jrnd, energy, monitor.change_norm, 
+                              uvt if fields else None)
             
         jrnd += 1
+
+
+def laser_simulation(uvt, alpha1, alpha2, alpha3, alphap,K, engine='dop853',
+                     monitor=None, T=None):
+    # engine: 'dop853' integrates the rhs adaptively, 'ssfm' uses the 
+    # fixed-step split-step fourier method (see split_step_propagator), 
+    # 'ssfm32' the same in single precision (see validate_single_precision)
+    # monitor: ConvergenceMonitor deciding when the round trips stop, default:
+    # relative change of the pulse profile below 1e-6
+    # T: length of the time window (default: module parameter T), the number 
+    # of time slices n is given by the length 2*n of uvt
+    if monitor is None:
+        monitor = ConvergenceMonitor()
     
+    # only the last fields are kept
+    for record in round_trips(uvt, alpha1, alpha2, alpha3, alphap, K, 
+                              engine, monitor, T, fields=True):
+        uvt = record.uvt
     
-    kur = np.abs(np.fft.fftshift(np.fft.fft(phi[-1,:])))
-    #M4 = kurtosis(kur)
-    M4 = moment(kur,4)/np.std(kur)**4
-    
-    end = time.time()
-    print(end-start)
-    
-    E = np.sqrt(np.trapz(phi[-1,:]**2, t_dis))
-    
-    states = np.array([E, M4, alpha1, alpha2, alpha3, alphap])
+    states = pulse_states(monitor.phi, alpha1, alpha2, alpha3, alphap, T)
     
     """ surface plot 
     # create meshgrid
@@ -188,3 +863,355 @@ def laser_simulation(uvt, alpha1, alpha2, alpha3, alphap,K):
     plt.show()
     """
     return (uvt,states)
+
+
+def round_trip_history(records):
+    """ Arrays of a stream of round trip records (see round_trips)
+    
+    Returns
+    --------------------------------------------------------------------------
+    history:    dict
+                'energy', 'change_norm': arrays, shape=[R,] and, if the 
+                records contain the fields, 'urnd', 'vrnd': arrays, 
+                shape=[R, n] - the fields u, v (time domain) after each round
+                trip
+    """
+    records = list(records)
+    history = {'energy': np.array([r.energy for r in records]),
+               'change_norm': np.array([r.change_norm for r in records])}
+    if records and records[0].uvt is not None:
+        uv = np.fft.ifft(np.array([r.uvt for r in records]).reshape(
+                            len(records), 2, -1), axis=-1)
+        history['urnd'] = uv[:, 0]
+        history['vrnd'] = uv[:, 1]
+    return history
+
+
+def laser_simulation_batch(uvt, alpha1, alpha2, alpha3, alphap, K,
+                           engine='dop853', tol=1e-6, T=None,
+                           max_round_trips=None, return_converged=False):
+    """ Batched version of laser_simulation
+    
+    All N cavities are advanced together: the fields are stacked along a 
+    leading batch axis, the FFTs of the rhs act on the last axis and one 
+    dop853 integration per round trip propagates the whole batch (the FFTs 
+    of the batch can be distributed over threads, see set_fft_backend). A 
+    cavity whose change_norm dropped below tol is frozen and removed from 
+    the active set, so every configuration stops after the same number of 
+    round trips as in a single call.
+    
+    Parameters
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,] or [N, 2*n]
+                initial fields (fourier space) - either one field shared by all
+                configurations or one field per configuration
+    alpha1, alpha2, alpha3, alphap, K:
+                arrays, shape=[N,]
+                orientation of the wave plates, the polarizer and the 
+                birefringence of each configuration
+    engine:     string
+                'dop853' (adaptive integration of the rhs), 'ssfm' 
+                (fixed-step split-step fourier method) or 'ssfm32' (the same
+                in single precision)
+    tol:        float
+                stop criterion of the relative change of the pulse profile
+    T:          float
+                length of the time window (default: module parameter T), the 
+                number of time slices n is given by the length of uvt
+    max_round_trips:
+                int
+                budget of round trips (default: Rnd)
+    return_converged:
+                bool
+                return the converged flags as well
+
+    Returns
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[N, 2*n]
+                fields after the last round trip of each configuration
+    states:     array, shape=[N, 6]
+                [E, M4, alpha1, alpha2, alpha3, alphap] of each configuration,
+                matching laser_simulation up to the integrator tolerance for 
+                configurations which mode-lock (the step size is controlled 
+                over the whole batch, so configurations which never converge 
+                may end up in a different point of their orbit)
+    converged:  array, shape=[N,]
+                bool, whether the change of the pulse profile of a 
+                configuration dropped below tol within the budget (only if 
+                return_converged)
+    """
+    if engine != 'dop853' and engine not in ssfm_dtypes:
+        raise ValueError('unknown engine: %s' % engine)
+    
+    n = np.shape(uvt)[-1]//2
+    t_dis, _ = time_frequency_grid(n, T)
+    
+    alphas = np.column_stack([np.ravel(alpha1), np.ravel(alpha2),
+                              np.ravel(alpha3), np.ravel(alphap)])
+    K = np.ravel(K).astype(float)
+    N = len(alphas)
+    
+    # one transfer function per configuration, shape=[N, 2, 2]
+    Transf = transfer_functions(*alphas.T)
+    
+    # fields of all cavities, shape=[N, 2, n] (fourier space)
+    uvt = np.broadcast_to(np.asarray(uvt, dtype=complex), 
+                          (N, 2*n)).reshape(N, 2, n).copy()
+    
+    # rhs of the ode, the operators of the grid are built only once
+    mlock_CNLS_rhs_batch = CNLSRightHandSide.for_grid(n, T)
+    
+    phi_past = None
+    phi = np.zeros([N, n])
+    change_norm = np.full(N, 100.0)
+    active = np.arange(N)
+    n_propagate = 0
+    jrnd = 0
+    # solving the ode for Rnd rounds - only cavities which did not converge
+    # yet are propagated
+    if max_round_trips is None:
+        max_round_trips = Rnd
+    while(jrnd < max_round_trips and len(active) > 0):
+        t0 = Z*jrnd
+        tend = Z*(jrnd+1)
+        
+        if engine in ssfm_dtypes:
+            # the propagators are only rebuilt when the active set changed
+            if len(active) != n_propagate:
+                propagate = split_step_propagator(K[active], n=n, T=T, 
+                                                  dtype=ssfm_dtypes[engine])
+                n_propagate = len(active)
+            sol = propagate(uvt[active])
+        else:
+            mlock_CNLS_rhs_batch.set_birefringence(K[active])
+            uvtsol = complex_ode(mlock_CNLS_rhs_batch)
+            uvtsol.set_integrator('dop853')
+            uvtsol.set_initial_value(uvt[active].ravel(), t0)
+            sol = uvtsol.integrate(tend)
+        
+        (fft, ifft) = fft_functions()
+        uv = ifft(sol.reshape(-1, 2, n))
+        uvplus = apply_transfer(Transf[active], uv)
+        uvt[active] = fft(uvplus)
+        
+        phi[active] = np.sqrt(np.abs(uvplus[:, 0, :])**2 + 
+                              np.abs(uvplus[:, 1, :])**2)
+        
+        if jrnd > 0:
+            change_norm[active] = \
+                np.linalg.norm(phi[active]-phi_past[active], axis=1)/ \
+                np.linalg.norm(phi_past[active], axis=1)
+            active = active[change_norm[active] > tol]
+        
+        phi_past = phi.copy()
+        jrnd += 1
+    
+    kur = np.abs(np.fft.fftshift(np.fft.fft(phi, axis=1), axes=1))
+    M4 = moment(kur, 4, axis=1)/np.std(kur, axis=1)**4
+    
+    E = np.sqrt(np.trapz(phi**2, t_dis, axis=1))
+    
+    states = np.column_stack([E, M4, alphas])
+    
+    if return_converged:
+        return (uvt.reshape(N, 2*n), states, change_norm <= tol)
+    return (uvt.reshape(N, 2*n), states)
+
+
+def sech_field(n=None, T=None):
+    """ sech shaped initial pulse in both polarizations (fourier space), as 
+    used for every call of laser_simulation in DeepMPC
+    """
+    t_dis, k = time_frequency_grid(n, T)
+    u = np.cosh(t_dis/2)**(-1)   # orthogonally polarized electric field 
+    v = np.cosh(t_dis/2)**(-1)   # envelopes in the optical fiber
+    
+    return np.concatenate([np.fft.fft(u), np.fft.fft(v)], axis=0)
+
+
+def resample_field(uvt, n_new):
+    """ Spectral interpolation of fields (fourier space, shape=[..., 2*n]) 
+    onto a grid with n_new slices of the same time window: the fourier 
+    coefficients are truncated or padded with zeros
+    """
+    uvt = np.asarray(uvt)
+    uvt = uvt.reshape(uvt.shape[:-1] + (2, -1))
+    n_old = uvt.shape[-1]
+    m = min(n_old, n_new)//2
+    
+    out = np.zeros(uvt.shape[:-1] + (n_new,), dtype=complex)
+    out[..., :m] = uvt[..., :m]
+    out[..., -m:] = uvt[..., -m:]
+    # np.fft.ifft divides by the number of slices
+    out *= n_new/n_old
+    
+    return out.reshape(out.shape[:-2] + (2*n_new,))
+
+
+def benchmark_engines(configurations, steps=(25, 50, 100)):
+    """ Accuracy and speed of the split-step engine compared to dop853
+    
+    Parameters
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+                (alpha1, alpha2, alpha3, alphap, K) of the test configurations
+    steps:      tuple
+                numbers of split-step steps per round trip to compare
+
+    Returns
+    --------------------------------------------------------------------------
+    results:    list
+                one tuple (steps, max rel. error of E, max rel. error of M4,
+                mean time per simulation in s) per number of steps, the first
+                entry (steps=None) is dop853
+    """
+    global ssfm_steps
+    uvt = sech_field()
+    default_steps = ssfm_steps
+    
+    def run(engine):
+        states = []
+        start = time.time()
+        for config in configurations:
+            (_, state) = laser_simulation(uvt, *config, engine=engine)
+            states.append(state)
+        return np.vstack(states), (time.time()-start)/len(configurations)
+    
+    reference, ref_time = run('dop853')
+    results = [(None, 0.0, 0.0, ref_time)]
+    try:
+        for steps_ in steps:
+            ssfm_steps = steps_
+            states, time_per_sim = run('ssfm')
+            err = np.abs(states[:, :2] - reference[:, :2])/ \
+                  np.abs(reference[:, :2])
+            results.append((steps_, err[:, 0].max(), err[:, 1].max(), 
+                            time_per_sim))
+    finally:
+        ssfm_steps = default_steps
+    
+    return results
+
+
+def benchmark_fft_backends(batch=64, evaluations=200, workers=None):
+    """ rhs evaluations per second (counted per cavity) of a batch of 
+    cavities for every available FFT backend, and the largest deviation of 
+    the rhs from the one of the 'numpy' backend
+    """
+    backends = ['numpy', 'scipy'] + (['pyfftw'] if pyfftw is not None else [])
+    previous = dict(fft_backend)
+    rhs = CNLSRightHandSide.for_grid()
+    rhs.set_birefringence(np.full(batch, 0.1))
+    uvt_batch = np.tile(sech_field(), batch)
+    
+    report = {}
+    try:
+        for backend in backends:
+            set_fft_backend(backend, workers)
+            result = rhs(0, uvt_batch).copy()
+            if backend == 'numpy':
+                reference = result
+            start = time.time()
+            for i in range(evaluations):
+                rhs(0, uvt_batch)
+            report[backend] = (evaluations*batch/(time.time()-start),
+                               np.max(np.abs(result - reference))/ \
+                               np.max(np.abs(reference)))
+    finally:
+        set_fft_backend(previous['name'], previous['workers'])
+    
+    return report
+
+def validate_single_precision(configurations, tol=1e-4):
+    """ Compares the single precision engine 'ssfm32' with 'ssfm'
+    
+    Both engines simulate all configurations with laser_simulation_batch. 
+    A configuration counts as mode-locked if one more round trip of the 
+    double precision result changes its pulse profile by less than 1e-5; 
+    for the others the round trips end at an arbitrary point of their orbit 
+    and the rounding errors are amplified, so their errors are reported 
+    separately.
+    
+    Parameters
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+                (alpha1, alpha2, alpha3, alphap, K) of the test configurations
+    tol:        float
+                required relative accuracy of E and M4
+
+    Returns
+    --------------------------------------------------------------------------
+    report:     dict
+                'locked' (count), max. and median relative errors of E and M4
+                of the mode-locked configurations ('max_error_E', ...), 
+                'within_tol' (fraction of the mode-locked configurations with 
+                both errors below tol), 'max_error_unlocked' (largest error of
+                the others) and the run times 'time_64', 'time_32' in s
+    """
+    configurations = np.atleast_2d(configurations)
+    uvt = sech_field()
+    
+    start = time.time()
+    (uvt_64, states_64) = laser_simulation_batch(uvt, *configurations.T, 
+                                                 engine='ssfm')
+    time_64 = time.time() - start
+    start = time.time()
+    (_, states_32) = laser_simulation_batch(uvt, *configurations.T, 
+                                            engine='ssfm32')
+    time_32 = time.time() - start
+    
+    # mode-locked: the double precision result is a steady state
+    locked = np.zeros(len(configurations), dtype=bool)
+    for i, config in enumerate(configurations):
+        (_, phi, _) = RoundTripMap(*config, engine='ssfm')(uvt_64[i])
+        uv = np.fft.ifft(uvt_64[i].reshape(2, -1), axis=-1)
+        phi_past = np.sqrt(np.abs(uv[0])**2 + np.abs(uv[1])**2)
+        locked[i] = np.linalg.norm(phi - phi_past) < \
+                    1e-5*np.linalg.norm(phi_past)
+    
+    err = np.abs(states_32[:, :2] - states_64[:, :2])/np.abs(states_64[:, :2])
+    report = {'locked': int(locked.sum()), 'time_64': time_64, 
+              'time_32': time_32, 'max_error_unlocked': np.nan}
+    if locked.any():
+        report.update({'max_error_E': err[locked, 0].max(),
+                       'median_error_E': np.median(err[locked, 0]),
+                       'max_error_M4': err[locked, 1].max(),
+                       'median_error_M4': np.median(err[locked, 1]),
+                       'within_tol': np.mean(np.all(err[locked] < tol, 
+                                                    axis=1))})
+    if not locked.all():
+        report['max_error_unlocked'] = err[~locked].max()
+    
+    return report
+
+if __name__ == "__main__":
+    for batch in (1, 16):
+        reference, operator = benchmark_rhs(batch=batch)
+        print('rhs evaluations per second (batch %s): reference %.0f, '
+              'CNLSRightHandSide %.0f' % (batch, reference, operator))
+    
+    # configurations with mode-locked (small M4) and cw (M4 ~ n) solutions
+    configurations = np.array([[0.444, 1.1078, 0.292, -0.7537, 0.0358],
+                               [1.4503, 0.7062, 0.1295, -0.7009, -0.1398],
+                               [0.1, 0.2, 0.3, 0.4, 0.1]])
+    for (steps, err_E, err_M4, time_per_sim) in \
+            benchmark_engines(configurations):
+        print('%s: rel. error E = %.2e, rel. error M4 = %.2e, '
+              '%.2f s per simulation' % (steps or 'dop853', err_E, err_M4,
+                                         time_per_sim))
+    
+    # fft backends on a batch of cavities
+    for backend, (rate, deviation) in sorted(benchmark_fft_backends().items()):
+        print('fft backend %-6s: %.0f rhs evaluations/s, deviation %.1e' 
+              % (backend, rate, deviation))
+    
+    # single precision engine on random configurations
+    rng = np.random.RandomState(0)
+    configurations = np.column_stack([rng.uniform(-np.pi/2, np.pi/2, 
+                                                  (32, 4)),
+                                      rng.uniform(-0.2, 0.2, 32)])
+    report = validate_single_precision(configurations)
+    for key in sorted(report):
+        print('ssfm32 %s: %s' % (key, report[key]))
@@ -0,0 +1,175 @@
+"""
+Two-stage simulation of many configurations: coarse screening, fine rerun
+
+Most configurations of a sweep do not mode-lock. A coarse pass on a grid with
+few time slices, a loose tolerance and a small round-trip budget ranks all
+configurations by the objective E/M4; only the promising ones are simulated
+again on the full grid. The final fields of the coarse pass are interpolated
+onto the full grid before E and M4 are evaluated - M4 (kurtosis of the
+spectrum) depends on the number of slices and would not be comparable
+otherwise.
+
+The agreement of both passes on the refined configurations (and optionally
+on all configurations, `validate=True`) is reported, so the screening can be
+checked for a new region of the parameter space.
+"""
+
+import time
+import argparse
+
+import numpy as np
+from scipy.stats import spearmanr
+
+import mlock_CNLS
+from mlock_CNLS import (laser_simulation_batch, sech_field, resample_field,
+                        pulse_states)
+
+
+def _states_on_grid(uvt, configurations, n, T=None):
+    # E and M4 of fields after interpolation onto a grid with n slices
+    uv = np.fft.ifft(resample_field(uvt, n).reshape(len(uvt), 2, n), axis=-1)
+    phi = np.sqrt(np.abs(uv[:, 0])**2 + np.abs(uv[:, 1])**2)
+    return np.vstack([pulse_states(p, *config[:4], T=T)
+                      for p, config in zip(phi, configurations)])
+
+
+def agreement(coarse, fine):
+    """ Agreement of coarse and fine states (rows [E, M4, ...])
+
+    Returns
+    --------------------------------------------------------------------------
+    report:     dict
+                median and maximum relative error of E and M4 and the rank
+                correlation (spearman) of the objective E/M4
+    """
+    err = np.abs(coarse[:, :2] - fine[:, :2])/np.abs(fine[:, :2])
+    report = {'count': len(fine),
+              'median_error_E': np.median(err[:, 0]),
+              'max_error_E': np.max(err[:, 0]),
+              'median_error_M4': np.median(err[:, 1]),
+              'max_error_M4': np.max(err[:, 1]),
+              'rank_correlation': np.nan}
+    if len(fine) > 2:
+        report['rank_correlation'] = spearmanr(coarse[:, 0]/coarse[:, 1],
+                                               fine[:, 0]/fine[:, 1])[0]
+    return report
+
+
+def screen_configurations(configurations, engine='dop853', keep=0.2,
+                          min_objective=None, coarse_n=128, coarse_tol=1e-4,
+                          coarse_round_trips=200, T=None, validate=False):
+    """ Coarse screening of all configurations and fine rerun of the best
+
+    Parameters
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+                (alpha1, alpha2, alpha3, alphap, K) of each simulation
+    engine:     string
+                'dop853' or 'ssfm', see laser_simulation
+    keep:       float
+                fraction of the configurations (best coarse objective E/M4)
+                which is simulated again on the full grid
+    min_objective:
+                float
+                additionally refine every configuration whose coarse
+                objective is at least min_objective
+    coarse_n:   int
+                number of time slices of the coarse grid. With T=60, n=64
+                does not resolve the pulses (spurious short pulses with a
+                small M4 get the best coarse objective), n=128 ranks the
+                mode-locked configurations like the full grid
+    coarse_tol: float
+                stop criterion of the coarse round trips
+    coarse_round_trips:
+                int
+                budget of round trips of the coarse pass
+    T:          float
+                length of the time window of both grids (default: module
+                parameter T)
+    validate:   bool
+                simulate all configurations on the full grid and report how
+                many of the truly best ones the screening selected
+
+    Returns
+    --------------------------------------------------------------------------
+    states:     array, shape=[N, 6]
+                [E, M4, alpha1, alpha2, alpha3, alphap] - full grid results of
+                the refined configurations, coarse results of the others
+    refined:    array, shape=[N,]
+                bool, whether a configuration was simulated on the full grid
+    report:     dict
+                'coarse_time', 'fine_time' (s), 'refined' (count) and the
+                agreement (see `agreement`) of both passes on the refined
+                configurations; with validate also 'all' (agreement on all
+                configurations) and 'recall' (fraction of the best `keep`
+                configurations of the full grid which were refined)
+    """
+    configurations = np.atleast_2d(np.asarray(configurations, dtype=float))
+    N = len(configurations)
+    n = mlock_CNLS.n
+
+    start = time.time()
+    (uvt, _) = laser_simulation_batch(sech_field(coarse_n, T),
+                                      *configurations.T, engine=engine,
+                                      tol=coarse_tol, T=T,
+                                      max_round_trips=coarse_round_trips)
+    coarse = _states_on_grid(uvt, configurations, n, T)
+    coarse_time = time.time() - start
+
+    # rank by the coarse objective, non-finite results are never refined
+    objective = coarse[:, 0]/coarse[:, 1]
+    objective[~np.isfinite(objective)] = -np.inf
+    order = np.argsort(-objective, kind='mergesort')
+    refined = np.zeros(N, dtype=bool)
+    refined[order[:int(np.ceil(keep*N))]] = True
+    if min_objective is not None:
+        refined |= objective >= min_objective
+    refined &= np.isfinite(objective)
+
+    start = time.time()
+    selected = np.arange(N) if validate else np.flatnonzero(refined)
+    fine = np.full_like(coarse, np.nan)
+    if len(selected) > 0:
+        (_, fine[selected]) = laser_simulation_batch(sech_field(n, T),
+                                    *configurations[selected].T,
+                                    engine=engine, T=T)
+    fine_time = time.time() - start
+
+    report = {'coarse_time': coarse_time, 'fine_time': fine_time,
+              'refined': int(refined.sum())}
+    if refined.any():
+        report.update(agreement(coarse[refined], fine[refined]))
+    if validate:
+        report['all'] = agreement(coarse, fine)
+        best = np.argsort(-fine[:, 0]/fine[:, 1],
+                          kind='mergesort')[:int(np.ceil(keep*N))]
+        report['recall'] = refined[best].mean()
+
+    states = np.where(refined[:, np.newaxis], fine, coarse)
+
+    return states, refined, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configurations', type=str,
+                        help='.npy file with rows (a1, a2, a3, ap, K)')
+    parser.add_argument('--keep', type=float, default=0.2)
+    parser.add_argument('--coarse_n', type=int, default=128)
+    parser.add_argument('--engine', type=str, default='dop853')
+    parser.add_argument('--validate', action='store_true')
+    parser.add_argument('--fft_backend', type=str, default='numpy',
+                        help="'numpy', 'scipy' or 'pyfftw'")
+    parser.add_argument('--fft_workers', type=int, default=None,
+                        help='threads of the fft backend (default: all cores)')
+    args = parser.parse_args()
+
+    mlock_CNLS.set_fft_backend(args.fft_backend, args.fft_workers)
+
+    (_, _, report) = screen_configurations(np.load(args.configurations),
+                                           engine=args.engine, keep=args.keep,
+                                           coarse_n=args.coarse_n,
+                                           validate=args.validate)
+    for key in sorted(report):
+        print('%s: %s' % (key, report[key]))
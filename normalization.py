@@ -0,0 +1,126 @@
+"""
+One-pass normalization statistics of data sets
+
+StreamingNormalizer collects the count, mean, variance, minimum and maximum
+of every column in a single pass over the rows. The rows can arrive in
+chunks (update): the statistics of a chunk are merged into the running ones
+with the parallel form of Welford's algorithm (Chan et al.), which is
+numerically stable for any chunking. For a single chunk the statistics and
+the normalized values are identical to the ones of np.mean, np.std, ...
+
+The two normalizations of DeepMPC
+    z-score:    (x - mean)/std
+    scaling:    1 + 9*(x - min)/(max - min)
+are applied to an array in place (out=x), to a new array, or lazily: a
+NormalizedView normalizes only the rows which are indexed, e.g. the windows
+of a batch, instead of materializing a normalized copy of the data set.
+"""
+
+import numpy as np
+
+
+class StreamingNormalizer(object):
+    """ Column statistics of rows which arrive in chunks """
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.M2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, rows):
+        """ adds rows (array, shape=[N, columns]) to the statistics and
+        returns the normalizer
+        """
+        rows = np.asarray(rows, dtype=float)
+        if rows.ndim == 1:
+            rows = rows[np.newaxis]
+        n = len(rows)
+        if n == 0:
+            return self
+        mean = rows.mean(axis=0)
+        M2 = np.sum((rows - mean)**2, axis=0)
+
+        if self.count == 0:
+            self.count = n
+            self.mean = mean
+            self.M2 = M2
+            self.min = rows.min(axis=0)
+            self.max = rows.max(axis=0)
+            return self
+
+        count = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta*n/count
+        self.M2 = self.M2 + M2 + delta**2*self.count*n/count
+        self.count = count
+        np.minimum(self.min, rows.min(axis=0), out=self.min)
+        np.maximum(self.max, rows.max(axis=0), out=self.max)
+        return self
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """ statistics of an iterable of row chunks (one pass) """
+        normalizer = cls()
+        for chunk in chunks:
+            normalizer.update(chunk)
+        return normalizer
+
+    @property
+    def var(self):
+        """ population variance (as np.var) """
+        return self.M2/self.count
+
+    @property
+    def std(self):
+        """ population standard deviation (as np.std) """
+        return np.sqrt(self.var)
+
+    def zscore(self, x, out=None, columns=slice(None)):
+        """ (x - mean)/std of rows x; out=x normalizes in place. columns
+        selects the statistics if x contains only some of the columns
+        """
+        out = np.subtract(x, self.mean[columns], out=out)
+        out /= self.std[columns]
+        return out
+
+    def scale(self, x, out=None, columns=slice(None)):
+        """ 1 + 9*(x - min)/(max - min) of rows x, see zscore """
+        out = np.subtract(x, self.min[columns], out=out)
+        out *= 9
+        out /= self.max[columns] - self.min[columns]
+        out += 1
+        return out
+
+    def view(self, data, method='zscore'):
+        """ lazily normalized data, see NormalizedView """
+        return NormalizedView(data, getattr(self, method))
+
+
+class NormalizedView(object):
+    """ Rows of a data set which are normalized when they are indexed
+
+    data[a:b] gives a view of the rows a:b (no copy); an index of rows
+    (integers or arrays, optionally followed by an index of the columns)
+    gives the normalized rows.
+    """
+    def __init__(self, data, transform):
+        self.data = data
+        self.transform = transform
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.transform(self.data), dtype=dtype)
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, slice) and isinstance(columns, slice) and \
+           columns == slice(None):
+            return NormalizedView(self.data[rows], self.transform)
+        return self.transform(self.data[rows])[..., columns]
@@ -0,0 +1,237 @@
+"""
+Quasi-random sweeps over the configurations (alpha1, alpha2, alpha3, alphap, K)
+
+A sweep draws its configurations from a scrambled Sobol sequence or from
+Latin hypercubes over box bounds; both cover the parameter space more evenly
+than independent random draws, so fewer simulations are needed for the same
+coverage. Every call of run_sweep appends one batch of new configurations,
+which is simulated in parallel by generate_dataset into its own directory.
+The Sobol sequence is continued from batch to batch; every batch of a Latin
+hypercube sweep is a new hypercube (seed + batch number).
+
+Layout of the sweep directory:
+    sweep.json              method, bounds, seed, the number of batches and
+                            their chunksizes
+    batch_<i>.npy           configurations of a batch, shape=[N_i, 5]
+    batch_<i>/              data set of the batch (see load_dataset)
+
+A batch is registered in sweep.json before it is simulated, so an interrupted
+sweep finishes its batches (generate_dataset resumes the missing chunks)
+before new configurations are drawn. Configurations which were already
+simulated in an earlier batch (compared after rounding to `decimals`) or
+which occur twice in a new batch are dropped before the dispatch.
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+from scipy.stats import qmc
+
+from dataset_generation import generate_dataset, load_dataset, columns
+
+# default bounds: the Jones matrices are periodic in the angles with period
+# pi, K covers the drift of the birefringence used in the control
+default_bounds = [(-np.pi/2, np.pi/2)]*4 + [(-0.25, 0.1)]
+
+
+def _sweep_path(out_dir):
+    return os.path.join(out_dir, 'sweep.json')
+
+
+def _batch_dir(out_dir, batch):
+    return os.path.join(out_dir, 'batch_%04d' % batch)
+
+
+def _batch_path(out_dir, batch):
+    return _batch_dir(out_dir, batch) + '.npy'
+
+
+def _write_sweep(out_dir, sweep):
+    # replace the file atomically, it is either the old or the new version
+    path = _sweep_path(out_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(sweep, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def design(method, count, bounds=None, seed=0, skip=0):
+    """ Quasi-random configurations
+
+    Parameters
+    --------------------------------------------------------------------------
+    method:     string
+                'sobol' (scrambled Sobol sequence) or 'lhs' (Latin hypercube)
+    count:      int
+                number of configurations
+    bounds:     list
+                (lower, upper) of alpha1, alpha2, alpha3, alphap and K
+                (default: default_bounds)
+    seed:       int
+                seed of the scrambling / of the hypercube
+    skip:       int
+                number of leading points of the Sobol sequence which are
+                skipped (the points drawn by earlier batches)
+
+    Returns
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[count, 5]
+    """
+    bounds = np.array(default_bounds if bounds is None else bounds,
+                      dtype=float)
+    if method == 'sobol':
+        sampler = qmc.Sobol(len(bounds), seed=seed)
+        if skip > 0:
+            sampler.fast_forward(skip)
+    elif method == 'lhs':
+        sampler = qmc.LatinHypercube(len(bounds), seed=seed)
+    else:
+        raise ValueError('unknown design: %s' % method)
+    return qmc.scale(sampler.random(count), bounds[:, 0], bounds[:, 1])
+
+
+def _keys(configurations, decimals):
+    return [tuple(row) for row in np.round(configurations, decimals)]
+
+
+def run_sweep(out_dir, count=256, method='sobol', bounds=None, seed=0,
+              configurations=None, decimals=10, chunksize=16,
+              max_workers=None, engine='dop853', early_abort=False):
+    """ Appends a batch of configurations to a sweep and simulates it
+
+    Parameters
+    --------------------------------------------------------------------------
+    out_dir:    string
+                directory of the sweep, created by the first call. method,
+                bounds and seed of an existing sweep are kept.
+    count:      int
+                number of new configurations (before the deduplication)
+    method:     string
+                'sobol' or 'lhs', see design
+    bounds:     list
+                (lower, upper) of the five parameters (default:
+                default_bounds)
+    seed:       int
+                seed of the design
+    configurations:
+                array, shape=[N, 5]
+                simulate these configurations instead of drawing new ones,
+                e.g. to add the configurations of an existing data set
+    decimals:   int
+                configurations are compared after rounding to this number of
+                decimals
+    chunksize, max_workers, engine, early_abort:
+                see generate_dataset; the batches of an interrupted sweep are
+                finished with their own chunksize
+
+    Returns
+    --------------------------------------------------------------------------
+    simulated:  int
+                number of new configurations which were simulated
+    """
+    if os.path.exists(_sweep_path(out_dir)):
+        with open(_sweep_path(out_dir)) as f:
+            sweep = json.load(f)
+    else:
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        sweep = {'method': method, 'seed': seed, 'drawn': 0, 'batches': 0,
+                 'chunksizes': [],
+                 'bounds': np.array(default_bounds if bounds is None
+                                    else bounds, dtype=float).tolist()}
+        _write_sweep(out_dir, sweep)
+
+    def simulate(batch, configurations):
+        return generate_dataset(configurations, _batch_dir(out_dir, batch),
+                                chunksize=sweep['chunksizes'][batch],
+                                max_workers=max_workers,
+                                engine=engine, early_abort=early_abort)
+
+    # finish the batches of an interrupted sweep (no simulations for
+    # complete batches)
+    known = set()
+    for batch in range(sweep['batches']):
+        batch_configurations = np.load(_batch_path(out_dir, batch))
+        simulate(batch, batch_configurations)
+        known.update(_keys(batch_configurations, decimals))
+
+    if configurations is None:
+        if sweep['method'] == 'sobol':
+            configurations = design('sobol', count, sweep['bounds'],
+                                    sweep['seed'], skip=sweep['drawn'])
+        else:
+            configurations = design(sweep['method'], count, sweep['bounds'],
+                                    sweep['seed'] + sweep['batches'])
+        sweep['drawn'] += count
+    configurations = np.atleast_2d(np.asarray(configurations,
+                                              dtype=np.float64))
+
+    # deduplication against the earlier batches and within the batch
+    new = []
+    for row, key in zip(configurations, _keys(configurations, decimals)):
+        if key not in known:
+            known.add(key)
+            new.append(row)
+
+    if len(new) == 0:
+        _write_sweep(out_dir, sweep)
+        return 0
+
+    # register the batch before the simulations start
+    batch = sweep['batches']
+    new = np.vstack(new)
+    np.save(_batch_path(out_dir, batch), new)
+    sweep['batches'] += 1
+    sweep['chunksizes'].append(chunksize)
+    _write_sweep(out_dir, sweep)
+    simulate(batch, new)
+
+    return len(new)
+
+
+def load_sweep(out_dir):
+    """ All simulated configurations of a sweep
+
+    Returns
+    --------------------------------------------------------------------------
+    configurations:
+                array, shape=[N, 5]
+    states:     array, shape=[N, 6]
+                columns `columns` of dataset_generation
+    locked:     array, shape=[N,]
+                bool, whether the configuration mode-locked
+    """
+    with open(_sweep_path(out_dir)) as f:
+        sweep = json.load(f)
+    parts = [load_dataset(_batch_dir(out_dir, batch))
+             for batch in range(sweep['batches'])]
+    if not parts:
+        return (np.zeros([0, 5]), np.zeros([0, len(columns)]),
+                np.zeros(0, dtype=bool))
+    return (np.vstack([p[0] for p in parts]),
+            np.vstack([np.column_stack(p[1]) for p in parts]),
+            np.concatenate([p[2] for p in parts]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', type=str, help='directory of the sweep')
+    parser.add_argument('--count', type=int, default=256,
+                        help='number of new configurations')
+    parser.add_argument('--method', type=str, default='sobol',
+                        help="'sobol' or 'lhs'")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--max_workers', type=int, default=None)
+    parser.add_argument('--engine', type=str, default='dop853')
+    parser.add_argument('--early_abort', action='store_true')
+    args = parser.parse_args()
+
+    simulated = run_sweep(args.out_dir, args.count, args.method,
+                          seed=args.seed, chunksize=args.chunksize,
+                          max_workers=args.max_workers, engine=args.engine,
+                          early_abort=args.early_abort)
+    print('%s new configurations, %s in the sweep' %
+          (simulated, len(load_sweep(args.out_dir)[0])))
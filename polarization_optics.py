@@ -0,0 +1,79 @@
+"""
+Vectorized Jones calculus of the waveplates & polarizer
+
+The transfer function of the cavity is the product of the Jones matrices of
+two quarter waveplates, a half waveplate and a polarizer, each rotated by its
+orientation angle. All functions broadcast over leading axes of the angles,
+so the transfer functions of a whole sweep of angle sets are computed at once
+and applied to a batch of fields with one contraction, without building
+intermediate (u, v) matrices.
+"""
+
+import numpy as np
+
+# Jones matrices of the quarter waveplate, the half waveplate and the
+# polarizer in the frame of their optical axes
+W4 = np.array([[np.exp(-1j*np.pi/4), 0], [0, np.exp(1j*np.pi/4)]])
+W2 = np.array([[-1j, 0], [0, 1j]])
+WP = np.array([[1, 0], [0, 0]])
+
+
+def rotation(alpha):
+    """ rotation matrices, shape=[..., 2, 2] for angles of shape [...] """
+    c = np.cos(alpha)
+    s = np.sin(alpha)
+    return np.stack((np.stack((c, -s), axis=-1),
+                     np.stack((s, c), axis=-1)), axis=-2)
+
+
+def rotated(W, alpha):
+    """ Jones matrices R(alpha) W R(alpha)^T, shape=[..., 2, 2] """
+    R = rotation(alpha)
+    return np.matmul(np.matmul(R, W), np.swapaxes(R, -1, -2))
+
+
+def transfer_functions(alpha1, alpha2, alpha3, alphap):
+    """ Transfer functions of many sets of orientations
+
+    Parameters
+    --------------------------------------------------------------------------
+    alpha1, alpha2, alpha3, alphap:
+                float or arrays (broadcastable)
+                orientation of the quarter waveplates, the half waveplate and
+                the polarizer
+
+    Returns
+    --------------------------------------------------------------------------
+    Transf:     array, shape=[..., 2, 2]
+                J1*JP*J2*J3 for every set of orientations
+    """
+    alpha1, alpha2, alpha3, alphap = np.broadcast_arrays(
+        *[np.asarray(alpha, dtype=float)
+          for alpha in (alpha1, alpha2, alpha3, alphap)])
+    J1 = rotated(W4, alpha1)
+    J2 = rotated(W4, alpha2)
+    J3 = rotated(W2, alpha3)
+    JP = rotated(WP, alphap)
+
+    return np.matmul(np.matmul(np.matmul(J1, JP), J2), J3)
+
+
+def apply_transfer(Transf, uv):
+    """ Applies transfer functions to fields
+
+    Parameters
+    --------------------------------------------------------------------------
+    Transf:     array, shape=[..., 2, 2]
+                transfer functions
+    uv:         array, shape=[..., 2, n]
+                fields (u, v) in the time domain
+
+    Returns
+    --------------------------------------------------------------------------
+    uvplus:     array, shape=[..., 2, n]
+                fields after the waveplates & polarizer
+    """
+    # contraction '...ij,...jn->...in'; np.matmul broadcasts over the leading
+    # axes like np.einsum, is faster for 2x2 matrices and gives the same
+    # result as the former product of a single transfer function and (u, v)
+    return np.matmul(Transf, uv)
@@ -0,0 +1,247 @@
+"""
+Append-only store of simulation results with fixed-width binary records
+
+All results (inputs, states and metadata of a simulation) go into one file of
+records of a numpy structured dtype. The file starts with a header which
+describes the dtype, followed by the records without any separator, so the
+records are read as a memory map (zero-copy, any number of rows without
+loading them into memory) and a column is a strided view of the map.
+
+Writers append whole batches of records under an exclusive lock of the file
+(fcntl, POSIX) and can run in several processes at once. A write which was
+interrupted leaves an incomplete record at the end of the file; readers
+ignore it and the next writer truncates it before appending. Without fcntl
+(Windows) only one process may write at a time. A writer can skip the
+records whose key fields (e.g. configuration and source) are stored already,
+so repeated or resumed runs do not duplicate them. The keys are compared by
+a 64-bit hash: the sorted hashes of the stored records are kept in a sidecar
+file <path>.keys.npy (8 bytes per record, memory mapped, searched with
+np.searchsorted), <path>.keys.json records the key fields and the number of
+records it covers. Records appended without a key check are added to the
+index by the next writer which checks keys.
+
+Layout of the file:
+    8 bytes     magic b'SIMSTORE'
+    8 bytes     length of the header (little endian uint64), multiple of 64
+    ...         json of the dtype description, padded with spaces
+    records     itemsize bytes each
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+magic = b'SIMSTORE'
+
+# records per chunk when the key index is built or merged
+index_chunksize = 2**20
+
+# fields which identify a simulation in the store
+configuration_fields = ('alpha1', 'alpha2', 'alpha3', 'alphap', 'K', 'source')
+
+# record of a laser simulation: inputs, states and metadata
+simulation_dtype = np.dtype([('alpha1', '<f8'), ('alpha2', '<f8'),
+                             ('alpha3', '<f8'), ('alphap', '<f8'),
+                             ('K', '<f8'), ('E', '<f8'), ('M4', '<f8'),
+                             ('locked', '?'), ('source', 'S15'),
+                             ('time', '<f8')])
+
+
+def key_hashes(records, fields):
+    """ 64-bit hashes (FNV-1a) of the values of fields of records,
+    shape=[N,] - equal values give equal hashes, -0.0 is hashed as 0.0
+    """
+    keys = np.empty(len(records), dtype=[(f, records.dtype[f])
+                                         for f in fields])
+    for f in fields:
+        keys[f] = records[f]
+        if keys.dtype[f].kind in 'fc':
+            keys[f] += 0
+    raw = keys.view(np.uint8).reshape(len(records), keys.dtype.itemsize)
+    h = np.full(len(records), 14695981039346656037, dtype=np.uint64)
+    prime = np.uint64(1099511628211)
+    for column in raw.T:
+        h ^= column
+        h *= prime
+    return h
+
+
+def _merge_sorted(index, keys, path):
+    # writes the sorted union of the sorted arrays index and keys to path,
+    # index is read in chunks; old element j moves behind the new keys which
+    # are sorted before it
+    positions = np.searchsorted(index, keys)
+    merged = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint64,
+                                       shape=(len(index) + len(keys),))
+    merged[positions + np.arange(len(keys))] = keys
+    for start in range(0, len(index), index_chunksize):
+        j = np.arange(start, min(start + index_chunksize, len(index)))
+        merged[j + np.searchsorted(positions, j, side='right')] = index[j]
+    merged.flush()
+    del merged
+
+
+def _header(dtype):
+    description = json.dumps(np.lib.format.dtype_to_descr(dtype)).encode()
+    length = 64*((16 + len(description) + 63)//64)
+    return magic + np.uint64(length).astype('<u8').tobytes() + \
+           description.ljust(length - 16)
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        start = f.read(16)
+        if len(start) < 16 or start[:8] != magic:
+            raise ValueError('%s is not a record store' % path)
+        length = int(np.frombuffer(start[8:], dtype='<u8')[0])
+        description = json.loads(f.read(length - 16).decode())
+    # json turns the tuples of the description into lists
+    descr = [tuple(field) for field in description] \
+            if isinstance(description, list) else description
+    return np.lib.format.descr_to_dtype(descr), length
+
+
+class RecordStore(object):
+    """ Append-only file of fixed-width records """
+    def __init__(self, path, dtype=simulation_dtype):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        path:       string
+                    file of the store, created with the header if it does
+                    not exist
+        dtype:      numpy dtype
+                    structured dtype of the records, has to match the one of
+                    an existing store (None: use the one of the file)
+        """
+        self.path = path
+        if not os.path.exists(path):
+            if dtype is None:
+                raise ValueError('a new store needs a dtype')
+            # the header is written to a temporary file which is linked to
+            # the path only if no other process created the store meanwhile
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(_header(np.dtype(dtype)))
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        self.dtype, self.offset = _read_header(path)
+        if dtype is not None and np.dtype(dtype) != self.dtype:
+            raise ValueError('%s contains records of a different dtype'
+                             % path)
+
+    def __len__(self):
+        """ number of complete records """
+        return (os.path.getsize(self.path) - self.offset)//self.dtype.itemsize
+
+    def append(self, records, unique=None):
+        """ appends records (structured array or anything convertible to
+        self.dtype) atomically with respect to other writers. unique is a
+        list of fields (e.g. configuration_fields): records whose values of
+        these fields are equal to the ones of a stored record or of an
+        earlier record of the batch are skipped. Returns the number of
+        appended records.
+        """
+        data = np.asarray(records, dtype=self.dtype).reshape(-1)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            # an interrupted write left an incomplete record
+            size = os.fstat(fd).st_size
+            tail = (size - self.offset) % self.dtype.itemsize
+            if tail:
+                os.ftruncate(fd, size - tail)
+            count = (size - tail - self.offset)//self.dtype.itemsize
+            if unique is not None:
+                # compared under the lock, no other writer appends meanwhile
+                index = self._key_index(list(unique), count)
+                hashes = key_hashes(data, list(unique))
+                # first record of each key of the batch which is not stored
+                keys, first = np.unique(hashes, return_index=True)
+                if len(index) > 0:
+                    found = index[np.minimum(np.searchsorted(index, keys),
+                                             len(index) - 1)] == keys
+                    keys, first = keys[~found], first[~found]
+                data = data[np.sort(first)]
+            view = memoryview(np.ascontiguousarray(data).tobytes())
+            while len(view) > 0:
+                view = view[os.write(fd, view):]
+            if unique is not None:
+                self._write_key_index(list(unique), index, keys,
+                                      count + len(data))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        return len(data)
+
+    def _key_index(self, fields, count):
+        # sorted hashes of the first count records, the records which are not
+        # in the index yet (or all, for other key fields) are added
+        path = self.path + '.keys.npy'
+        covered = 0
+        if os.path.exists(self.path + '.keys.json'):
+            with open(self.path + '.keys.json') as f:
+                meta = json.load(f)
+            if meta['fields'] == fields and meta['count'] <= count:
+                covered = meta['count']
+        index = np.load(path, mmap_mode='r') if covered > 0 else \
+                np.zeros(0, dtype=np.uint64)
+        if covered < count:
+            stored = np.memmap(self.path, dtype=self.dtype, mode='r',
+                               offset=self.offset, shape=(count,))
+            missing = np.unique(np.concatenate(
+                [key_hashes(stored[start:start + index_chunksize], fields)
+                 for start in range(covered, count, index_chunksize)]))
+            del stored
+            self._write_key_index(fields, index, missing, count)
+            index = np.load(path, mmap_mode='r')
+        return index
+
+    def _write_key_index(self, fields, index, keys, count):
+        # merged index and its description, each replaced atomically
+        path = self.path + '.keys'
+        _merge_sorted(index, keys, path + '.tmp.npy')
+        os.replace(path + '.tmp.npy', path + '.npy')
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump({'fields': fields, 'count': int(count)}, f)
+        os.replace(path + '.json.tmp', path + '.json')
+
+    def records(self, mode='r'):
+        """ memory map of all complete records, shape=[len(self),] - records
+        appended afterwards need a new call
+        """
+        count = len(self)
+        if count == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode=mode,
+                         offset=self.offset, shape=(count,))
+
+
+def simulation_records(configurations, states, locked=None, source=''):
+    """ records of simulation_dtype for configurations [N, 5] (alpha1,
+    alpha2, alpha3, alphap, K) and their states [N, >=2] ([E, M4, ...])
+    """
+    configurations = np.atleast_2d(configurations)
+    states = np.atleast_2d(states)
+    records = np.zeros(len(configurations), dtype=simulation_dtype)
+    for i, name in enumerate(['alpha1', 'alpha2', 'alpha3', 'alphap', 'K']):
+        records[name] = configurations[:, i]
+    records['E'] = states[:, 0]
+    records['M4'] = states[:, 1]
+    records['locked'] = True if locked is None else locked
+    records['source'] = source
+    records['time'] = time.time()
+    return records
@@ -0,0 +1,68 @@
+"""
+Sensitivity of the steady state to the orientations of the waveplates
+
+The angles enter the cavity only through the transfer function Transf which
+is applied once per round trip: a small change of the angles perturbs the
+round-trip map but not the propagation. The steady state of a perturbed
+configuration is therefore close to the unperturbed one and the round trips
+started from the converged field reach it after a few iterations.
+laser_simulation_jacobian uses this for central finite differences: all
+eight perturbed configurations are warm started from the converged field and
+propagated together with laser_simulation_batch.
+"""
+
+import numpy as np
+
+from mlock_CNLS import laser_simulation_batch
+
+
+def laser_simulation_jacobian(uvt, alpha1, alpha2, alpha3, alphap, K,
+                              engine='dop853', step=1e-2, tol=1e-8):
+    """ Steady state and its Jacobian with respect to the angles
+
+    Parameters
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,]
+                initial fields (fourier space)
+    alpha1, alpha2, alpha3, alphap, K:
+                float
+                orientation of the wave plates, the polarizer and the
+                birefringence
+    engine:     string
+                'dop853' or 'ssfm', see laser_simulation
+    step:       float
+                step of the central differences in rad
+    tol:        float
+                stop criterion of the round trips (relative change of the
+                pulse profile), smaller than the one of laser_simulation since
+                the convergence error is divided by the step
+
+    Returns
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,]
+                fields after the last round trip
+    states:     array, shape=[6,]
+                [E, M4, alpha1, alpha2, alpha3, alphap] as in laser_simulation
+    jacobian:   array, shape=[2, 4]
+                d(E, M4)/d(alpha1, alpha2, alpha3, alphap), meaningful only if
+                the configuration mode-locks (the round trips converge)
+    converged:  bool
+                whether the round trips of the configuration and of all eight
+                perturbed ones reached tol within Rnd round trips; otherwise
+                the jacobian is not meaningful
+    """
+    alphas = np.array([alpha1, alpha2, alpha3, alphap], dtype=float)
+
+    (uvt, states, converged) = laser_simulation_batch(
+        uvt, *alphas, K=K, engine=engine, tol=tol, return_converged=True)
+
+    # rows: alpha + step*e_i, then alpha - step*e_i
+    perturbed = alphas + step*np.vstack((np.eye(4), -np.eye(4)))
+    (_, states_pert, converged_pert) = laser_simulation_batch(
+        uvt[0], *perturbed.T, K=np.full(8, K), engine=engine, tol=tol,
+        return_converged=True)
+
+    jacobian = (states_pert[:4, :2] - states_pert[4:, :2]).T/(2*step)
+
+    return (uvt[0], states[0], jacobian,
+            bool(converged[0] and np.all(converged_pert)))
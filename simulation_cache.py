@@ -0,0 +1,210 @@
+"""
+Persistent cache for laser_simulation results
+
+Results are addressed by a hash of the quantized inputs (initial field uvt,
+angles, birefringence K and the engine) and of model_fingerprint, the model
+constants and solver settings of mlock_CNLS: results of a changed model are
+not returned. Lookups go through two tiers:
+    1. an in-memory LRU dictionary with a fixed number of entries
+    2. an on-disk sqlite database, bounded in size; the least recently used
+       entries are evicted once the bound is exceeded
+The access times of the disk tier are written with the next stored result
+(or every access_batch hits), not on every hit.
+"""
+
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+import mlock_CNLS
+from mlock_CNLS import laser_simulation, ConvergenceMonitor
+
+# module parameters of mlock_CNLS which determine the result of a simulation
+model_parameters = ('D', 'E0', 'tau', 'g0', 'Gamma', 'Z', 'T', 'Rnd',
+                    'ssfm_steps')
+
+
+def model_fingerprint():
+    """ model constants, solver settings and the default stop criteria of
+    mlock_CNLS as text; part of the key of every cached result
+    """
+    parameters = [(name, repr(getattr(mlock_CNLS, name)))
+                  for name in model_parameters]
+    criteria = [(type(c).__name__, sorted((k, repr(v))
+                                          for k, v in vars(c).items()))
+                for c in ConvergenceMonitor().criteria]
+    return repr((parameters, criteria))
+
+
+class SimulationCache(object):
+    """ Memoization of laser_simulation with a memory and a disk tier """
+    def __init__(self, path='simulation_cache.sqlite', max_memory_entries=4096,
+                 max_disk_bytes=8*2**30, decimals=10,
+                 simulate=laser_simulation, access_batch=1000):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        path:       string
+                    sqlite file of the disk tier, None for a memory-only cache
+        max_memory_entries:
+                    int
+                    number of results kept in memory
+        max_disk_bytes:
+                    int
+                    bound of the size of the stored results on disk
+        decimals:   int
+                    inputs are rounded to this number of decimals before
+                    hashing, so that numerically identical calls share a key
+        simulate:   function
+                    laser_simulation or a function with the same signature
+                    which computes the missing results, e.g. a
+                    WarmStartSimulation - the key is the field of the caller,
+                    not the one the simulation starts from
+        access_batch:
+                    int
+                    the access times of disk hits are written once this many
+                    are pending (and with every stored result, close)
+        """
+        self.simulate = simulate
+        self.access_batch = access_batch
+        # last access times of disk hits which are not written yet
+        self.pending_access = {}
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.decimals = decimals
+        self.memory = OrderedDict()
+
+        # hit/miss counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                            'key TEXT PRIMARY KEY, uvt BLOB, states BLOB, '
+                            'size INTEGER, last_access REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS access ON '
+                            'results (last_access)')
+            self.db.commit()
+            self.disk_bytes = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def key(self, uvt, alpha1, alpha2, alpha3, alphap, K, engine='dop853'):
+        """ content address of a simulation """
+        inputs = np.round(np.array([alpha1, alpha2, alpha3, alphap, K],
+                                   dtype=np.float64), self.decimals)
+        field = np.round(np.asarray(uvt, dtype=np.complex128), self.decimals)
+        # avoid different hashes for +0.0 and -0.0
+        inputs += 0.0
+        field += 0.0
+
+        h = hashlib.sha1(engine.encode())
+        h.update(model_fingerprint().encode())
+        h.update(inputs.tobytes())
+        h.update(field.tobytes())
+        return h.hexdigest()
+
+    def stats(self):
+        """ hit/miss counters and the sizes of both tiers """
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self.memory),
+                'disk_bytes': self.disk_bytes if self.db is not None else 0}
+
+    def get(self, key):
+        """ cached (uvt, states) of a key or None """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return self.memory[key]
+
+        if self.db is not None:
+            row = self.db.execute('SELECT uvt, states FROM results '
+                                  'WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.pending_access[key] = time.time()
+                if len(self.pending_access) >= self.access_batch:
+                    self._write_access()
+                    self.db.commit()
+                result = (np.frombuffer(row[0], dtype=np.complex128).copy(),
+                          np.frombuffer(row[1], dtype=np.float64).copy())
+                self._remember(key, result)
+                self.disk_hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """ stores (uvt, states) in both tiers """
+        self._remember(key, result)
+
+        if self.db is not None:
+            uvt = np.asarray(result[0], dtype=np.complex128).tobytes()
+            states = np.asarray(result[1], dtype=np.float64).tobytes()
+            size = len(uvt) + len(states)
+            self.pending_access.pop(key, None)
+            old = self.db.execute('SELECT size FROM results WHERE key = ?',
+                                  (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO results VALUES '
+                            '(?, ?, ?, ?, ?)',
+                            (key, uvt, states, size, time.time()))
+            self.disk_bytes += size - (old[0] if old is not None else 0)
+            self._write_access()
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict()
+            self.db.commit()
+
+    def laser_simulation(self, uvt, alpha1, alpha2, alpha3, alphap, K,
+                         engine='dop853'):
+        """ drop-in replacement of mlock_CNLS.laser_simulation """
+        key = self.key(uvt, alpha1, alpha2, alpha3, alphap, K, engine)
+        result = self.get(key)
+        if result is None:
+            result = self.simulate(uvt, alpha1, alpha2, alpha3, alphap, K,
+                                   engine=engine)
+            self.put(key, result)
+        # copies, the caller may modify the returned arrays
+        return (result[0].copy(), result[1].copy())
+
+    def close(self):
+        if self.db is not None:
+            self._write_access()
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def _write_access(self):
+        # pending access times in one statement, committed by the caller
+        if self.pending_access:
+            self.db.executemany('UPDATE results SET last_access = ? '
+                                'WHERE key = ?',
+                                [(t, key) for key, t in
+                                 self.pending_access.items()])
+            self.pending_access = {}
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # remove the least recently used entries until 90% of the bound
+        target = 0.9*self.max_disk_bytes
+        while self.disk_bytes > target:
+            rows = self.db.execute('SELECT key, size FROM results '
+                                   'ORDER BY last_access LIMIT 1000').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.disk_bytes <= target:
+                    break
+                self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                self.disk_bytes -= size
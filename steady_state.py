@@ -0,0 +1,193 @@
+"""
+Accelerated search of the steady state of the laser cavity
+
+laser_simulation iterates the round-trip map x -> R(x) (propagation followed
+by the waveplates & polarizer) until the pulse profile does not change
+anymore, which can take hundreds of round trips close to the mode-locking
+region. The steady state is a fixed point of R up to a global phase, which
+the cavity does not fix. steady_state_simulation removes the phase
+(G(x) = R(x)*exp(-i*arg<x, R(x)>)) and accelerates the fixed-point iteration
+of G with Anderson mixing: the next field is the combination of the last
+`memory` iterates which minimizes the linearized residual G(x) - x.
+
+If the accelerated iteration diverges (residual growing far beyond the best
+one, non-finite fields), the solver falls back to plain round trips starting
+from the best field found so far.
+"""
+
+import time
+
+import numpy as np
+
+from mlock_CNLS import RoundTripMap, pulse_states, Rnd
+
+
+def _profile(uvt):
+    uv = np.fft.ifft(uvt.reshape(2, -1), axis=-1)
+    return np.sqrt(np.abs(uv[0])**2 + np.abs(uv[1])**2)
+
+
+def steady_state_simulation(uvt, alpha1, alpha2, alpha3, alphap, K,
+                            engine='dop853', method='anderson', memory=5,
+                            tol=1e-6, start_tol=1e-2, max_round_trips=None,
+                            divergence=10.0, max_restarts=3):
+    """ Steady state of one configuration with an accelerated solver
+
+    Parameters
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,]
+                initial fields (fourier space)
+    alpha1, alpha2, alpha3, alphap, K:
+                float
+                orientation of the wave plates, the polarizer and the
+                birefringence
+    engine:     string
+                'dop853' or 'ssfm', see laser_simulation
+    method:     string
+                'anderson' or 'iterate' (plain round trips as in
+                laser_simulation)
+    memory:     int
+                number of previous iterates used by the Anderson mixing
+    tol:        float
+                the solver stops once the relative change of the pulse profile
+                over one round trip is below tol (as in laser_simulation)
+    start_tol:  float
+                plain round trips are used until the relative change of the
+                pulse profile stayed below start_tol for `memory` round trips
+    max_round_trips:
+                int
+                budget of round trips (default: Rnd)
+    divergence: float
+                an Anderson step whose residual exceeds `divergence` times the
+                smallest residual so far is rejected and the mixing restarted
+                from the best iterate
+    max_restarts:
+                int
+                number of rejected steps before falling back to plain
+                iteration (also used after 4*memory steps without progress)
+
+    Returns
+    --------------------------------------------------------------------------
+    uvt:        array, shape=[2*n,]
+                fields after the last round trip
+    states:     array, shape=[6,]
+                [E, M4, alpha1, alpha2, alpha3, alphap] as in laser_simulation
+    info:       dict
+                'iterations' (round trips), 'wall_time' (s), 'converged',
+                'change_norm', 'method' ('anderson', 'iterate' or
+                'anderson+iterate' after a fallback)
+    """
+    if method not in ('anderson', 'iterate'):
+        raise ValueError('unknown method: %s' % method)
+    if max_round_trips is None:
+        max_round_trips = Rnd
+
+    start = time.time()
+    round_trip = RoundTripMap(alpha1, alpha2, alpha3, alphap, K, engine)
+
+    def G(x):
+        # round trip with the global phase removed
+        y, phi, _ = round_trip(x)
+        overlap = np.vdot(x, y)
+        if overlap != 0:
+            y = y*np.conj(overlap)/np.abs(overlap)
+        return y, phi
+
+    x = np.asarray(uvt, dtype=complex)
+    g, phi = G(x)
+    f = g - x
+    phi_x = _profile(x)
+    change_norm = np.linalg.norm(phi - phi_x)/np.linalg.norm(phi_x)
+
+    # best iterate (smallest residual) of the accelerated phase
+    best = (np.inf, g, phi)
+    dF = []
+    dG = []
+    restarts = 0
+    stalled = 0
+    below = 0
+    used = 'iterate'
+
+    while change_norm > tol and round_trip.evaluations < max_round_trips:
+        # far from the steady state the map is strongly nonlinear, the
+        # mixing starts once the round trips reached the linear regime
+        below = below + 1 if change_norm < start_tol else 0
+        if used == 'iterate' and method == 'anderson' and below >= memory:
+            used = 'anderson'
+
+        if used == 'anderson' and dF:
+            # the round trip is not complex differentiable (|u|**2 terms),
+            # the mixing coefficients are real
+            A = np.column_stack(dF)
+            gamma = np.linalg.lstsq(np.vstack((A.real, A.imag)),
+                                    np.concatenate((f.real, f.imag)),
+                                    rcond=None)[0]
+            x_new = g - np.column_stack(dG).dot(gamma)
+        else:
+            x_new = g
+
+        g_new, phi_new = G(x_new)
+        f_new = g_new - x_new
+        residual = np.linalg.norm(f_new)
+        finite = bool(np.isfinite(residual))
+
+        if used == 'anderson':
+            if not finite or residual > divergence*best[0]:
+                # reject the step and restart the mixing from the best
+                # iterate
+                restarts += 1
+                dF = []
+                dG = []
+                x_new = best[1]
+                g_new, phi_new = G(x_new)
+                f_new = g_new - x_new
+                residual = np.linalg.norm(f_new)
+            else:
+                dF.append(f_new - f)
+                dG.append(g_new - g)
+                if len(dF) > memory:
+                    dF.pop(0)
+                    dG.pop(0)
+
+            if residual < best[0]:
+                best = (residual, g_new, phi_new)
+                stalled = 0
+            else:
+                stalled += 1
+            if restarts > max_restarts or stalled > 4*memory:
+                # no progress: plain round trips from the best iterate
+                used = 'anderson+iterate'
+                x_new = best[1]
+                g_new, phi_new = G(x_new)
+                f_new = g_new - x_new
+
+        # change of the pulse profile over the last round trip
+        phi_x = _profile(x_new)
+        change_norm = np.linalg.norm(phi_new - phi_x)/np.linalg.norm(phi_x)
+        x, g, f, phi = x_new, g_new, f_new, phi_new
+
+    info = {'iterations': round_trip.evaluations,
+            'wall_time': time.time() - start,
+            'converged': bool(change_norm <= tol),
+            'change_norm': change_norm,
+            'method': used}
+
+    return g, pulse_states(phi, alpha1, alpha2, alpha3, alphap), info
+
+
+if __name__ == "__main__":
+    from mlock_CNLS import sech_field
+
+    # mode-locked configurations and one cw configuration
+    configurations = np.array([[-0.162, 0.939, -0.831, -0.566, 0.073],
+                               [-0.338, -0.022, 0.555, -1.38, 0.096],
+                               [1.169, -1.513, 0.652, -1.567, -0.067],
+                               [0.1, 0.2, 0.3, 0.4, 0.1]])
+    for config in configurations:
+        for method in ('iterate', 'anderson'):
+            (_, states, info) = steady_state_simulation(sech_field(), *config,
+                                                        method=method)
+            print('K = %6.3f %-8s: %3d round trips, %.2f s, E = %.6f, '
+                  'M4 = %.4f (%s)' % (config[4], method, info['iterations'],
+                                      info['wall_time'], states[0], states[1],
+                                      info['method']))
@@ -0,0 +1,196 @@
+"""
+Surrogate of the laser simulation with a fallback to the ode solver
+
+A Gaussian process regression of (log E, log M4) on the configuration
+(alpha1, alpha2, alpha3, alphap, K) answers a query without a simulation if
+its predictive standard deviation - on the log scale, i.e. the relative
+uncertainty of E and M4 - is below a threshold. Otherwise the simulator runs
+and its result is added to the training set of the process, so the
+surrogate improves where the queries go. The queries of the control and of
+dense sweeps stay in well sampled regions and are mostly answered by the
+surrogate.
+
+The inputs are embedded by warm_start.configuration_features.
+"""
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+
+from mlock_CNLS import laser_simulation
+from warm_start import configuration_features
+
+
+class GaussianProcess(object):
+    """ GP regression of several outputs with one squared exponential kernel
+
+    The outputs are standardized; the length scale of the kernel and the
+    noise variance maximize the log marginal likelihood (signal variance 1).
+    """
+    def __init__(self, length_scale=1.0, noise=1e-4):
+        self.length_scale = length_scale
+        self.noise = noise
+        self.X = None
+
+    def _kernel(self, A, B):
+        d2 = np.sum(A**2, 1)[:, np.newaxis] + np.sum(B**2, 1) - 2*A.dot(B.T)
+        return np.exp(-0.5*np.maximum(d2, 0)/self.length_scale**2)
+
+    def _negative_log_likelihood(self, log_params, X, Y):
+        self.length_scale, self.noise = np.exp(log_params)
+        K = self._kernel(X, X) + (self.noise + 1e-10)*np.eye(len(X))
+        try:
+            factor = cho_factor(K, lower=True)
+        except np.linalg.LinAlgError:
+            return np.inf
+        alpha = cho_solve(factor, Y)
+        return 0.5*np.sum(Y*alpha) + \
+               Y.shape[1]*np.sum(np.log(np.diag(factor[0])))
+
+    def fit(self, X, Y, optimize=True, max_points=500):
+        """ Conditions the process on the data
+
+        Parameters
+        ----------------------------------------------------------------------
+        X:          array, shape=[N, d]
+                    inputs
+        Y:          array, shape=[N, m]
+                    outputs
+        optimize:   bool
+                    fit the length scale and the noise (otherwise the
+                    previous values are kept)
+        max_points: int
+                    the hyperparameters are fitted on a random subset of at
+                    most max_points points
+        """
+        self.X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        self.Y_mean = Y.mean(0)
+        self.Y_std = np.maximum(Y.std(0), 1e-12)
+        Y = (Y - self.Y_mean)/self.Y_std
+
+        if optimize:
+            subset = np.random.RandomState(0).permutation(len(X))[:max_points]
+            start = np.log([self.length_scale, self.noise])
+            result = minimize(self._negative_log_likelihood, start,
+                              args=(self.X[subset], Y[subset]),
+                              method='L-BFGS-B',
+                              bounds=[(np.log(1e-2), np.log(1e2)),
+                                      (np.log(1e-8), np.log(1.0))])
+            self.length_scale, self.noise = np.exp(result.x)
+
+        K = self._kernel(self.X, self.X) + \
+            (self.noise + 1e-10)*np.eye(len(self.X))
+        self.factor = cho_factor(K, lower=True)
+        self.alpha = cho_solve(self.factor, Y)
+
+    def predict(self, X):
+        """ predictive mean and standard deviation, shape=[N, m] each """
+        K_star = self._kernel(np.atleast_2d(X), self.X)
+        mean = K_star.dot(self.alpha)
+        v = cho_solve(self.factor, K_star.T)
+        var = np.maximum(1 - np.sum(K_star.T*v, 0), 0)
+        std = np.sqrt(var)[:, np.newaxis]
+        return mean*self.Y_std + self.Y_mean, std*self.Y_std
+
+
+class SurrogateSimulation(object):
+    """ laser_simulation answered by a Gaussian process where it is certain
+    """
+    def __init__(self, simulate=laser_simulation, threshold=0.02,
+                 min_points=20, refit_every=50, max_points=2000,
+                 K_scale=10.0):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        simulate:   function
+                    laser_simulation or a function with the same signature,
+                    e.g. SimulationCache.laser_simulation
+        threshold:  float
+                    largest predictive standard deviation of log E and log M4
+                    (approximately the relative error) of an answer of the
+                    surrogate. The standard deviation has to be below half of
+                    the prior one as well: far from the training set it
+                    approaches the spread of the training outputs, which is
+                    small if they come from a narrow region.
+        min_points: int
+                    every query is simulated until the training set has
+                    min_points points
+        refit_every:
+                    int
+                    the hyperparameters are fitted again after this many new
+                    points (in between the process is only conditioned on
+                    them)
+        max_points: int
+                    size of the training set, the oldest points are dropped
+        K_scale:    float
+                    weight of the birefringence in the embedding
+                    (configuration_features)
+        """
+        self.simulate = simulate
+        self.threshold = threshold
+        self.min_points = min_points
+        self.refit_every = refit_every
+        self.max_points = max_points
+        self.K_scale = K_scale
+        self.process = GaussianProcess()
+        self.configurations = np.zeros([0, 5])
+        self.targets = np.zeros([0, 2])
+        self.stale = False
+        self.since_refit = 0
+        self.surrogate_answers = 0
+        self.simulations = 0
+
+    def add(self, configurations, states):
+        """ adds simulated configurations [N, 5] and their states [N, >=2]
+        ([E, M4, ...]) to the training set, e.g. an existing data set
+        """
+        states = np.atleast_2d(states)
+        keep = np.all(np.isfinite(states[:, :2]), 1) & \
+               np.all(states[:, :2] > 0, 1)
+        self.configurations = np.vstack((self.configurations,
+                                         np.atleast_2d(configurations)[keep]))
+        self.targets = np.vstack((self.targets, np.log(states[keep, :2])))
+        self.configurations = self.configurations[-self.max_points:]
+        self.targets = self.targets[-self.max_points:]
+        self.since_refit += int(keep.sum())
+        self.stale = True
+
+    def predict(self, configurations):
+        """ predicted [E, M4] and the standard deviations of log E and log M4,
+        shape=[N, 2] each (None, None while the training set is too small)
+        """
+        if len(self.targets) < self.min_points:
+            return None, None
+        if self.stale:
+            # the first fit and every refit_every new points also fit the
+            # hyperparameters
+            optimize = self.process.X is None or \
+                       self.since_refit >= self.refit_every
+            self.process.fit(configuration_features(self.configurations,
+                                                    self.K_scale),
+                             self.targets, optimize=optimize)
+            if optimize:
+                self.since_refit = 0
+            self.stale = False
+        mean, std = self.process.predict(
+            configuration_features(configurations, self.K_scale))
+        return np.exp(mean), std
+
+    def __call__(self, uvt, alpha1, alpha2, alpha3, alphap, K, **kwargs):
+        """ Same signature as laser_simulation; uvt of the result is None if
+        the surrogate answered the query
+        """
+        configuration = np.array([alpha1, alpha2, alpha3, alphap, K],
+                                 dtype=float)
+        prediction, std = self.predict(configuration)
+        if prediction is not None and np.max(std) <= self.threshold and \
+           np.all(std < 0.5*self.process.Y_std):
+            self.surrogate_answers += 1
+            return (None, np.concatenate((prediction[0], configuration[:4])))
+
+        (uvt_out, states) = self.simulate(uvt, alpha1, alpha2, alpha3, alphap,
+                                          K, **kwargs)
+        self.simulations += 1
+        self.add(configuration, states)
+        return (uvt_out, states)
@@ -0,0 +1,197 @@
+"""
+Stateful laser cavity as the plant of the control
+
+laser_simulation starts every call from the sech pulse and iterates until the
+cavity is stationary. The physical laser keeps its field while the control
+turns the waveplates and the birefringence drifts: after a change of K or of
+the angles the pulse evolves from the state it was in. VirtualLaser keeps the
+field between calls and advances it by a fixed number of round trips for
+every control step (stopping earlier once the pulse profile is stationary),
+so a slowly drifting K is tracked without converging from scratch.
+
+Only the control inputs which are applied may advance the cavity. What-if
+evaluations of other inputs (retries, comparisons) use probe, which starts
+from the current field and does not change the cavity; a following step
+with the same parameters reuses the probed result. snapshot and restore
+return the cavity to an earlier state, e.g. to apply corrected inputs for
+control steps which were applied already.
+
+Note: the state of the plant depends on its history - where several steady
+states coexist for one configuration, it can stay in a different one than a
+cold started simulation.
+"""
+
+import numpy as np
+
+from mlock_CNLS import RoundTripMap, pulse_states, sech_field
+
+
+class VirtualLaser(object):
+    """ Laser cavity which keeps its field between control steps """
+    def __init__(self, uvt=None, engine='dop853', round_trips=20, tol=1e-6,
+                 T=None, settle_round_trips=None):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        uvt:        array, shape=[2*n,]
+                    initial field of the cavity (fourier space), default: the
+                    sech pulse
+        engine:     string
+                    'dop853', 'ssfm' or 'ssfm32', see laser_simulation
+        round_trips:
+                    int
+                    round trips per control step
+        tol:        float
+                    a control step ends early once the relative change of the
+                    pulse profile over one round trip is below tol; further
+                    steps with unchanged parameters do not propagate
+        T:          float
+                    length of the time window (default: module parameter T),
+                    the number of time slices n is given by the length of uvt
+        settle_round_trips:
+                    int
+                    round trips of the first step after a reset, e.g. Rnd of
+                    mlock_CNLS: the cavity settles into the steady state of
+                    the first configuration as laser_simulation does instead
+                    of returning the transient of the initial field (default:
+                    round_trips)
+        """
+        self.engine = engine
+        self.round_trips = round_trips
+        self.settle_round_trips = settle_round_trips
+        self.tol = tol
+        self.T = T
+        self.reset(uvt)
+
+    def reset(self, uvt=None):
+        """ restarts the cavity from the field uvt (default: sech pulse) """
+        self.uvt = sech_field(T=self.T) if uvt is None else \
+                   np.array(uvt, dtype=complex)
+        self.parameters = None
+        self.round_trip = None
+        self.phi = None
+        self.change_norm = np.inf
+        # round trips propagated since the last reset
+        self.total_round_trips = 0
+        # results of probe since the last change of the cavity
+        self.probes = {}
+
+    def snapshot(self):
+        """ state of the cavity, see restore """
+        return (self.uvt, self.parameters, self.round_trip, self.phi,
+                self.change_norm, self.total_round_trips)
+
+    def restore(self, state):
+        """ returns the cavity to a state of snapshot """
+        (self.uvt, self.parameters, self.round_trip, self.phi,
+         self.change_norm, self.total_round_trips) = state
+        self.probes = {}
+
+    def _advance(self, parameters, round_trips):
+        # state of the cavity after the round trips of a step with the given
+        # parameters, the cavity itself is not changed
+        (uvt, current, round_trip, phi, change_norm,
+         total_round_trips) = self.snapshot()
+        if round_trips is None:
+            round_trips = self.round_trips
+            if total_round_trips == 0 and \
+               self.settle_round_trips is not None:
+                round_trips = self.settle_round_trips
+        if parameters != current:
+            round_trip = RoundTripMap(*parameters, engine=self.engine,
+                                      n=len(uvt)//2, T=self.T)
+            change_norm = np.inf
+        uvt = uvt.copy()
+
+        for i in range(round_trips):
+            if change_norm <= self.tol:
+                break
+            (uvt, phi_new, _) = round_trip(uvt)
+            if phi is not None:
+                change_norm = np.linalg.norm(phi_new - phi)/ \
+                              np.linalg.norm(phi)
+            phi = phi_new
+            total_round_trips += 1
+
+        if phi is None:
+            # no round trip yet: profile of the initial field
+            uv = np.fft.ifft(uvt.reshape(2, -1), axis=-1)
+            phi = np.sqrt(np.abs(uv[0])**2 + np.abs(uv[1])**2)
+
+        return (uvt, parameters, round_trip, phi, change_norm,
+                total_round_trips)
+
+    def step(self, alpha1, alpha2, alpha3, alphap, K, round_trips=None):
+        """ Advances the cavity with the given parameters
+
+        Parameters
+        ----------------------------------------------------------------------
+        alpha1, alpha2, alpha3, alphap, K:
+                    float
+                    orientation of the wave plates, the polarizer and the
+                    birefringence during this control step
+        round_trips:
+                    int
+                    round trips of this step (default: self.round_trips,
+                    self.settle_round_trips for the first step after a reset)
+
+        Returns
+        ----------------------------------------------------------------------
+        states:     array, shape=[6,]
+                    [E, M4, alpha1, alpha2, alpha3, alphap] after the step as
+                    in laser_simulation
+        """
+        parameters = tuple(float(p) for p in (alpha1, alpha2, alpha3, alphap,
+                                              K))
+        key = (parameters, round_trips)
+        state = self.probes[key] if key in self.probes else \
+                self._advance(parameters, round_trips)
+        self.restore(state)
+        return pulse_states(self.phi, *parameters[:4], T=self.T)
+
+    def __call__(self, uvt, alpha1, alpha2, alpha3, alphap, K, **kwargs):
+        """ Same signature as laser_simulation, so the plant can replace it in
+        the control; uvt is ignored, the cavity continues from its own field
+        """
+        states = self.step(alpha1, alpha2, alpha3, alphap, K)
+        return (self.uvt.copy(), states)
+
+    def probe(self, uvt, alpha1, alpha2, alpha3, alphap, K, round_trips=None,
+              **kwargs):
+        """ Same signature as __call__: the states the cavity would reach
+        with these parameters, without advancing it
+        """
+        parameters = tuple(float(p) for p in (alpha1, alpha2, alpha3, alphap,
+                                              K))
+        state = self._advance(parameters, round_trips)
+        self.probes[(parameters, round_trips)] = state
+        return (state[0].copy(), pulse_states(state[3], *parameters[:4],
+                                              T=self.T))
+
+
+if __name__ == "__main__":
+    import time
+
+    from mlock_CNLS import laser_simulation
+
+    # slowly drifting birefringence at fixed angles
+    alphas = (-0.162, 0.939, -0.831, -0.566)
+    K_drift = 0.073 + 0.01*np.sin(np.linspace(0, np.pi, 20))
+
+    start = time.time()
+    cold = np.array([laser_simulation(sech_field(), *alphas, K=K,
+                                      engine='ssfm')[1] for K in K_drift])
+    cold_time = time.time() - start
+
+    laser = VirtualLaser(engine='ssfm')
+    # transient of the first configuration
+    laser.step(*alphas, K=K_drift[0], round_trips=500)
+    start = time.time()
+    plant = np.array([laser.step(*alphas, K=K) for K in K_drift])
+    plant_time = time.time() - start
+
+    err = np.abs(plant[:, :2] - cold[:, :2])/np.abs(cold[:, :2])
+    print('cold starts:   %.2f s' % cold_time)
+    print('virtual laser: %.2f s, %d round trips' % (plant_time,
+                                                    laser.total_round_trips))
+    print('max. relative deviation of E, M4: %.2e, %.2e' % tuple(err.max(0)))
@@ -0,0 +1,117 @@
+"""
+Warm-started laser simulations
+
+The round trips of laser_simulation stop once the pulse profile does not
+change anymore. Starting from the steady state of a nearby configuration
+instead of the sech pulse reaches this point after a few round trips.
+FieldStore keeps the final fields of past simulations and returns the one of
+the nearest configuration; WarmStartSimulation seeds every call with it.
+
+Note: where several steady states coexist for one configuration, a warm
+started simulation can end in a different state than a cold started one.
+"""
+
+import numpy as np
+
+from mlock_CNLS import laser_simulation
+
+
+def configuration_features(configurations, K_scale=10.0):
+    """ embedding of configurations [N, 5] (alpha1, alpha2, alpha3, alphap,
+    K) in which nearby configurations are close, shape=[N, 9]: the Jones
+    matrices are periodic in the angles with period pi, (cos 2a, sin 2a)
+    respects this periodicity; K is weighted by K_scale
+    """
+    configurations = np.atleast_2d(np.asarray(configurations, dtype=float))
+    alphas = 2*configurations[:, :4]
+    return np.column_stack((np.cos(alphas), np.sin(alphas),
+                            K_scale*configurations[:, 4]))
+
+
+class FieldStore(object):
+    """ Final fields of simulations, searchable by (angles, K) """
+    def __init__(self, max_entries=10000, K_scale=10.0):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        max_entries:
+                    int
+                    number of stored fields, the oldest ones are overwritten
+        K_scale:    float
+                    weight of the birefringence relative to the angles in the
+                    distance
+        """
+        self.max_entries = max_entries
+        self.K_scale = K_scale
+        self.features = None
+        self.fields = None
+        self.count = 0
+
+    def _features(self, alpha1, alpha2, alpha3, alphap, K):
+        return configuration_features([alpha1, alpha2, alpha3, alphap, K],
+                                      self.K_scale)[0]
+
+    def __len__(self):
+        return min(self.count, self.max_entries)
+
+    def add(self, alpha1, alpha2, alpha3, alphap, K, uvt):
+        """ stores the final field uvt of a configuration """
+        feature = self._features(alpha1, alpha2, alpha3, alphap, K)
+        if self.features is None:
+            self.features = np.zeros([self.max_entries, len(feature)])
+            self.fields = np.zeros([self.max_entries, len(uvt)], dtype=complex)
+        # ring buffer
+        self.features[self.count % self.max_entries] = feature
+        self.fields[self.count % self.max_entries] = uvt
+        self.count += 1
+
+    def nearest(self, alpha1, alpha2, alpha3, alphap, K):
+        """ field of the nearest stored configuration and its distance
+        (None, inf) if the store is empty
+        """
+        if len(self) == 0:
+            return None, np.inf
+        feature = self._features(alpha1, alpha2, alpha3, alphap, K)
+        dist = np.linalg.norm(self.features[:len(self)] - feature, axis=1)
+        index = np.argmin(dist)
+        return self.fields[index].copy(), dist[index]
+
+
+class WarmStartSimulation(object):
+    """ laser_simulation seeded with the nearest converged field """
+    def __init__(self, simulate=laser_simulation, store=None,
+                 max_distance=0.5):
+        """
+        Parameters
+        ----------------------------------------------------------------------
+        simulate:   function
+                    laser_simulation or a function with the same signature,
+                    e.g. SimulationCache.laser_simulation
+        store:      FieldStore
+                    store of the final fields, shared between simulators
+        max_distance:
+                    float
+                    stored fields further away than this are not used
+        """
+        self.simulate = simulate
+        self.store = FieldStore() if store is None else store
+        self.max_distance = max_distance
+        self.warm_starts = 0
+        self.cold_starts = 0
+
+    def __call__(self, uvt, alpha1, alpha2, alpha3, alphap, K, **kwargs):
+        """ Same signature as laser_simulation; uvt is the initial field of a
+        cold start and is only used if no stored field is close enough
+        """
+        seed, dist = self.store.nearest(alpha1, alpha2, alpha3, alphap, K)
+        if dist <= self.max_distance:
+            uvt = seed
+            self.warm_starts += 1
+        else:
+            self.cold_starts += 1
+
+        (uvt_out, states) = self.simulate(uvt, alpha1, alpha2, alpha3, alphap,
+                                          K, **kwargs)
+        self.store.add(alpha1, alpha2, alpha3, alphap, K, uvt_out)
+
+        return (uvt_out, states)